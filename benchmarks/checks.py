@@ -0,0 +1,149 @@
+"""
+Regression checks which run against the in-memory project of the benchmarks. Usage::
+
+    DJANGO_SETTINGS_MODULE=benchmarks.settings python -m benchmarks.checks
+"""
+
+import unittest
+
+class ResourceLinksTest(unittest.TestCase):
+    def find(self, text):
+        from cmsplugin_markup_tracwiki import tracwiki
+        return tracwiki.DjangoComponent(tracwiki.get_environment()).find_resource_links(text)
+
+    def test_punctuation(self):
+        self.assertEqual(self.find(u"See cms:about-us."), {'cms': set([u'about-us'])})
+        self.assertEqual(self.find(u"(see cms:about-us)"), {'cms': set([u'about-us'])})
+        self.assertEqual(self.find(u"Entries blog:en:first, blog:second; and filer:image.png!"), {
+            'blog': set([u'en:first', u'second']),
+            'filer': set([u'image.png']),
+        })
+
+    def test_brackets(self):
+        self.assertEqual(self.find(u"[cms:about-us About us]."), {'cms': set([u'about-us'])})
+        self.assertEqual(self.find(u"[[cms:about-us|About us]]"), {'cms': set([u'about-us'])})
+        self.assertEqual(self.find(u"[filer:\"file name.png\" File]"), {'filer': set([u'file name.png'])})
+        self.assertEqual(self.find(u"[cms:about-us#team Team] [cms:about-us?x=1]"), {'cms': set([u'about-us'])})
+
+    def test_not_links(self):
+        self.assertEqual(self.find(u"!cms:escaped x-cms:other [cms: current page]"), {})
+
+class PrerenderCacheKeyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import datetime
+
+        from django.conf import settings
+
+        from cms import models as cms_models
+
+        from cmsplugin_blog import models as blog_models
+
+        from cmsplugin_markup import models as markup_models
+
+        from cmsplugin_markup_tracwiki import tracwiki
+
+        from benchmarks import utils
+
+        def create_page(slug, application_urls=None):
+            page = cms_models.Page.objects.create(
+                site_id=settings.SITE_ID,
+                template=settings.CMS_TEMPLATES[0][0],
+                created_by='checks',
+                changed_by='checks',
+                published=True,
+                in_navigation=True,
+            )
+            cms_models.Title.objects.create(page=page, language=settings.LANGUAGE_CODE, title=slug, slug=slug, application_urls=application_urls)
+            return page
+
+        def create_plugin(placeholder):
+            plugin = markup_models.MarkupField(
+                body=u"See [cms: this page].",
+                markup=tracwiki.Markup.identifier,
+                plugin_type='MarkupPlugin',
+                placeholder=placeholder,
+                language=settings.LANGUAGE_CODE,
+                position=0,
+            )
+            plugin.save()
+            return plugin
+
+        tracwiki.set_current_request(utils.make_request())
+        try:
+            cls.page = create_page('prerender-page')
+            placeholder = cms_models.Placeholder.objects.create(slot='content')
+            cls.page.placeholders.add(placeholder)
+            cls.page_plugin = create_plugin(placeholder)
+
+            cls.blog_page = create_page('prerender-blog', 'BlogApphook')
+            entry = blog_models.Entry.objects.create(is_published=True, pub_date=datetime.datetime.now())
+            blog_models.EntryTitle.objects.create(entry=entry, language=settings.LANGUAGE_CODE, title=u"Entry", slug='prerender-entry')
+            placeholder = cms_models.Placeholder.objects.create(slot='content')
+            entry.placeholders.add(placeholder)
+            cls.blog_plugin = create_plugin(placeholder)
+        finally:
+            tracwiki.set_current_request(None)
+
+    def get_key(self, request, plugin):
+        from django import template
+        from django.utils import translation
+
+        from cmsplugin_markup_tracwiki import tracwiki
+
+        translation.activate(plugin.language)
+        try:
+            context = template.RequestContext(request, {
+                'object': plugin,
+                'placeholder': plugin.placeholder,
+            })
+            return tracwiki.Markup()._get_cache_key(plugin.body, context)
+        finally:
+            translation.deactivate()
+
+    def live_request(self, page):
+        from django.contrib.auth import middleware as auth_middleware
+        from django.contrib.sessions import middleware as sessions_middleware
+        from django.test import client
+
+        from cms.middleware import page as page_middleware
+
+        # As it comes through a HTTPS server on a non-default port
+        request = client.RequestFactory().get(page.get_absolute_url(), **{
+            'HTTP_HOST': 'example.com:8443',
+            'SERVER_PORT': '8443',
+            'wsgi.url_scheme': 'https',
+        })
+        for middleware in (sessions_middleware.SessionMiddleware(), auth_middleware.AuthenticationMiddleware(), page_middleware.CurrentPageMiddleware()):
+            middleware.process_request(request)
+        return request
+
+    def test_page(self):
+        from cmsplugin_markup_tracwiki.management.commands import tracwiki_prerender
+
+        prerendered = tracwiki_prerender.make_request('example.com', self.page_plugin, 'https', 8443)
+        self.assertEqual(self.get_key(prerendered, self.page_plugin), self.get_key(self.live_request(self.page), self.page_plugin))
+
+    def test_blog(self):
+        from cmsplugin_markup_tracwiki.management.commands import tracwiki_prerender
+
+        prerendered = tracwiki_prerender.make_request('example.com', self.blog_plugin, 'https', 8443)
+        self.assertEqual(prerendered.current_page.pk, self.blog_page.pk)
+        # Blog entries are displayed under the page the blog is hooked to, which is then the current page
+        self.assertEqual(self.get_key(prerendered, self.blog_plugin), self.get_key(self.live_request(self.blog_page), self.blog_plugin))
+
+    def test_domains(self):
+        from cmsplugin_markup_tracwiki.management.commands import tracwiki_prerender
+
+        # Content is rendered only for the site displaying it
+        self.assertEqual(tracwiki_prerender.get_domains(self.page_plugin), [self.page.site.domain])
+        self.assertEqual(tracwiki_prerender.get_domains(self.blog_plugin), [self.blog_page.site.domain])
+
+def main():
+    from benchmarks import utils
+
+    utils.setup_database()
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Generators of synthetic wiki documents.
+"""
+
+PARAGRAPH = u"""Lorem ipsum dolor sit amet, '''consectetur''' adipiscing elit. Sed ''do eiusmod'' tempor
+incididunt ut labore et dolore magna aliqua, `ut enim` ad minim veniam.
+"""
+
+TABLE_ROW = u"""|| Cell %(i)d || '''bold''' || ''italic'' || `code` ||
+"""
+
+CODE_BLOCK = u"""{{{
+#!python
+def function_%(i)d(value):
+    \"\"\"Returns a processed value.\"\"\"
+    if value is None:
+        return [x * 2 for x in range(%(i)d)]
+    return dict((k, v) for (k, v) in value.iteritems() if k)
+}}}
+"""
+
+LINKS = u"""See [cms:page-%(i)d page], [cms:page-%(j)d], [filer:file-%(i)d.txt file],
+[blog:entry-%(i)d entry], [cms:missing-%(i)d missing] and http://example.com/%(i)d.
+"""
+
+def document(size):
+    """
+    Returns a document of approximately `size` characters, made of sections with headings and paragraphs.
+    """
+
+    sections = []
+    length = 0
+    i = 0
+    while length < size:
+        section = u"= Section %d =\n\n%s\n" % (i, PARAGRAPH)
+        sections.append(section)
+        length += len(section)
+        i += 1
+    return u''.join(sections)
+
+def headings(count):
+    return u''.join(u"%s Heading %d %s\n\n%s\n" % ('=' * (i % 3 + 1), i, '=' * (i % 3 + 1), PARAGRAPH) for i in range(count))
+
+def tables(count, rows=10):
+    return u''.join(u"= Table %d =\n\n%s\n" % (i, u''.join(TABLE_ROW % {'i': j} for j in range(rows))) for i in range(count))
+
+def code_blocks(count):
+    return u''.join(u"= Code %d =\n\n%s\n" % (i, CODE_BLOCK % {'i': i}) for i in range(count))
+
+def links(count, targets):
+    """
+    Returns a document with `count` paragraphs of links to `targets` different pages, files and blog entries.
+    """
+
+    return u''.join(LINKS % {'i': i % targets, 'j': (i + 1) % targets} + u"\n" for i in range(count))
+
+def plugins(plugin_ids):
+    return u''.join(u"%s\n\n[[CMSPlugin(%d)]]\n\n" % (PARAGRAPH, plugin_id) for plugin_id in plugin_ids)
+
+def mixed(count, targets, plugin_ids):
+    return headings(count) + tables(count // 5 or 1) + code_blocks(count // 5 or 1) + links(count, targets) + plugins(plugin_ids)
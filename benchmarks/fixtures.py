@@ -0,0 +1,69 @@
+"""
+Creates CMS pages, django-filer files, blog entries and plugins which synthetic documents link to.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.core.files import base
+
+from cms import models as cms_models
+
+from cmsplugin_blog import models as blog_models
+
+from cmsplugin_markup import models as markup_models
+
+from filer.models import filemodels as filer_models
+
+from cmsplugin_markup_tracwiki import tracwiki
+
+from benchmarks import documents, utils
+
+def create_fixtures(targets=20, plugins=5):
+    """
+    Creates `targets` pages (with reverse IDs `page-<n>`), files (`file-<n>.txt`) and blog entries
+    (`entry-<n>`), and `plugins` plugins on a placeholder, to be embedded into documents.
+
+    Returns a tuple of the placeholder and a list of plugin IDs.
+    """
+
+    # Plugins are rendered when saved
+    tracwiki.set_current_request(utils.make_context()['request'])
+    try:
+        for i in range(targets):
+            page = cms_models.Page(
+                site_id=settings.SITE_ID,
+                template=settings.CMS_TEMPLATES[0][0],
+                reverse_id='page-%d' % i,
+                created_by='benchmarks',
+                changed_by='benchmarks',
+                published=True,
+                in_navigation=True,
+            )
+            page.save()
+            cms_models.Title.objects.create(page=page, language=settings.LANGUAGE_CODE, title=u"Page %d" % i, slug='page-%d' % i)
+
+            f = filer_models.File(original_filename='file-%d.txt' % i)
+            f.file.save('file-%d.txt' % i, base.ContentFile(documents.PARAGRAPH.encode('utf-8')), save=False)
+            f.save()
+
+            entry = blog_models.Entry.objects.create(is_published=True, pub_date=datetime.datetime.now())
+            blog_models.EntryTitle.objects.create(entry=entry, language=settings.LANGUAGE_CODE, title=u"Entry %d" % i, slug='entry-%d' % i)
+
+        placeholder = cms_models.Placeholder.objects.create(slot='content')
+        plugin_ids = []
+        for i in range(plugins):
+            plugin = markup_models.MarkupField(
+                body=documents.PARAGRAPH,
+                markup=tracwiki.Markup.identifier,
+                plugin_type='MarkupPlugin',
+                placeholder=placeholder,
+                language=settings.LANGUAGE_CODE,
+                position=i,
+            )
+            plugin.save()
+            plugin_ids.append(plugin.pk)
+    finally:
+        tracwiki.set_current_request(None)
+
+    return (placeholder, plugin_ids)
@@ -0,0 +1,99 @@
+"""
+Compares peak memory usage of `Markup.parse` and `Markup.parse_iter` on a large document, and checks
+that memory usage stays flat across repeated renders.
+
+Each mode is run in its own process. Usage::
+
+    DJANGO_SETTINGS_MODULE=benchmarks.settings python -m benchmarks.memory [size in MB]
+    DJANGO_SETTINGS_MODULE=benchmarks.settings python -m benchmarks.memory repeat [renders]
+"""
+
+import gc
+import os
+import subprocess
+import sys
+
+def run(mode, size):
+    from benchmarks import documents, utils
+
+    utils.setup_database()
+    context = utils.make_context()
+    value = documents.document(size)
+
+    from cmsplugin_markup_tracwiki import tracwiki
+    parser = tracwiki.Markup()
+
+    before = utils.peak_rss()
+    devnull = open(os.devnull, 'w')
+    if mode == 'parse':
+        devnull.write(parser.parse(value, context).encode('utf-8'))
+    else:
+        for chunk in parser.parse_iter(value, context):
+            devnull.write(chunk.encode('utf-8'))
+    after = utils.peak_rss()
+
+    print "%s: peak RSS %d kB, increase during rendering %d kB" % (mode, after, after - before)
+
+def check_repeated(renders):
+    """
+    Renders the same document many times and checks that scripts and stylesheets do not accumulate and
+    that the number of objects and resident memory do not grow. Exits with status 1 if they do.
+    """
+
+    from benchmarks import documents, utils
+
+    utils.setup_database()
+    value = documents.code_blocks(5) + documents.headings(20)
+
+    from cmsplugin_markup_tracwiki import tracwiki
+    parser = tracwiki.Markup()
+
+    def render():
+        parser.parse(value, utils.make_context())
+        return (len(parser.get_scripts()), len(parser.get_stylesheets()))
+
+    # Warms up lazily loaded components and caches
+    for i in range(max(renders / 10, 10)):
+        assets = render()
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    rss_before = utils.current_rss()
+
+    failures = []
+    for i in range(renders):
+        current = render()
+        if current != assets:
+            failures.append("numbers of scripts and stylesheets changed from %s to %s at render %d" % (assets, current, i))
+            break
+    gc.collect()
+    objects_after = len(gc.get_objects())
+    rss_after = utils.current_rss()
+
+    print "repeat: %d renders, objects %d -> %d, RSS %d kB -> %d kB" % (renders, objects_before, objects_after, rss_before, rss_after)
+
+    # Allows for some noise, but not for growth with the number of renders
+    if objects_after - objects_before > 1000:
+        failures.append("number of objects grew by %d" % (objects_after - objects_before,))
+    if rss_after - rss_before > 2048:
+        failures.append("resident memory grew by %d kB" % (rss_after - rss_before,))
+
+    for failure in failures:
+        print "FAIL: %s" % (failure,)
+    if failures:
+        sys.exit(1)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'repeat':
+        check_repeated(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+        return
+
+    if len(sys.argv) > 2:
+        run(sys.argv[1], int(float(sys.argv[2]) * 1024 * 1024))
+        return
+
+    size = sys.argv[1] if len(sys.argv) > 1 else '5'
+    for mode in ('parse', 'parse_iter'):
+        subprocess.check_call([sys.executable, '-m', 'benchmarks.memory', mode, size])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmarks of rendering, link resolving, serving of static files and replacing of plugin IDs.
+
+Reports throughput, latency percentiles and database queries per call of each benchmark. Usage::
+
+    DJANGO_SETTINGS_MODULE=benchmarks.settings python -m benchmarks.run [--iterations N] [benchmark ...]
+"""
+
+import optparse
+import sys
+
+def get_benchmarks():
+    """
+    Sets up the database with fixtures and returns a list of (name, function) pairs.
+    """
+
+    from cmsplugin_markup_tracwiki import tracwiki
+    from cmsplugin_markup_tracwiki.templatetags import tracwiki as tracwiki_tags
+
+    from benchmarks import documents, fixtures, utils
+
+    utils.setup_database()
+    targets = 20
+    (placeholder, plugin_ids) = fixtures.create_fixtures(targets=targets)
+
+    parser = tracwiki.Markup()
+
+    def parse(value):
+        def f():
+            context = utils.make_context(placeholder=placeholder)
+            parser.parse(value, context, placeholder)
+        return f
+
+    def link():
+        context = utils.make_context()
+        for i in range(targets):
+            tracwiki_tags.tracwiki_link(context, 'cms:page-%d' % i)
+            tracwiki_tags.tracwiki_link(context, 'blog:entry-%d' % i)
+            tracwiki_tags.tracwiki_link(context, 'filer:file-%d.txt' % i)
+
+    def link_cold():
+        tracwiki.clear_link_cache()
+        link()
+
+    def chrome():
+        request = utils.make_request('/tracwiki/chrome/common/css/trac.css')
+        response = parser.serve_trac_path(request, 'chrome/common/css/trac.css')
+        for chunk in response:
+            pass
+
+    plugins_text = documents.plugins(plugin_ids * 10)
+    id_dict = dict((plugin_id, plugin_id) for plugin_id in plugin_ids)
+
+    def replace():
+        parser.replace_plugins(plugins_text, id_dict)
+
+    return [
+        ('parse:headings', parse(documents.headings(100))),
+        ('parse:tables', parse(documents.tables(20))),
+        ('parse:code', parse(documents.code_blocks(20))),
+        ('parse:links', parse(documents.links(50, targets))),
+        ('parse:plugins', parse(documents.plugins(plugin_ids))),
+        ('parse:mixed', parse(documents.mixed(50, targets, plugin_ids))),
+        ('tracwiki_link', link),
+        ('tracwiki_link:cold', link_cold),
+        ('serve_trac_path:chrome', chrome),
+        ('replace_plugins', replace),
+    ]
+
+def main():
+    option_parser = optparse.OptionParser(usage="%prog [options] [benchmark ...]")
+    option_parser.add_option('--iterations', '-n', type='int', default=100, help="Number of measured calls of each benchmark. Default is 100.")
+    (options, names) = option_parser.parse_args()
+
+    from benchmarks import utils
+
+    benchmarks = get_benchmarks()
+    unknown = set(names) - set(name for (name, f) in benchmarks)
+    if unknown:
+        option_parser.error("Unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+
+    print "%-24s %12s %10s %10s %10s %8s" % ("benchmark", "calls/s", "p50 ms", "p90 ms", "p99 ms", "queries")
+    for (name, f) in benchmarks:
+        if names and name not in names:
+            continue
+        result = utils.measure(f, options.iterations)
+        print "%-24s %12.1f %10.2f %10.2f %10.2f %8d" % (name, result['throughput'], result['p50'], result['p90'], result['p99'], result['queries'])
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
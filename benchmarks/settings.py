@@ -0,0 +1,77 @@
+# Django settings for running benchmarks against an in-memory SQLite database
+
+import os
+import tempfile
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+SITE_ID = 1
+SECRET_KEY = 'benchmarks'
+ROOT_URLCONF = 'benchmarks.urls'
+
+LANGUAGE_CODE = 'en'
+LANGUAGES = (
+    ('en', 'English'),
+)
+
+# Fixtures store files
+MEDIA_ROOT = tempfile.mkdtemp(prefix='tracwiki-benchmarks-')
+MEDIA_URL = '/media/'
+STATIC_URL = '/static/'
+
+TEMPLATE_DIRS = (
+    os.path.join(os.path.dirname(__file__), 'templates'),
+)
+
+TEMPLATE_CONTEXT_PROCESSORS = (
+    'django.core.context_processors.auth',
+    'django.core.context_processors.i18n',
+    'django.core.context_processors.request',
+    'django.core.context_processors.media',
+    'cms.context_processors.media',
+)
+
+MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cms.middleware.page.CurrentPageMiddleware',
+    'cms.middleware.user.CurrentUserMiddleware',
+    'cmsplugin_markup_tracwiki.middleware.CurrentRequestMiddleware',
+)
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.sites',
+    'django.contrib.admin',
+    'cms',
+    'menus',
+    'mptt',
+    'publisher',
+    'easy_thumbnails',
+    'filer',
+    'tagging',
+    'simple_translation',
+    'cmsplugin_blog',
+    'cmsplugin_markup',
+    'cmsplugin_markup_tracwiki',
+)
+
+CMS_TEMPLATES = (
+    ('benchmarks/page.html', 'Page'),
+)
+
+CMS_MARKUP_OPTIONS = (
+    'cmsplugin_markup_tracwiki',
+)
+CMS_MARKUP_RENDER_ALWAYS = True
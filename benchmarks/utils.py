@@ -0,0 +1,89 @@
+from __future__ import with_statement
+
+import os
+import time
+
+from django import template
+from django.conf import settings
+from django.contrib.auth import models as auth_models
+from django.core import management
+from django.db import connection
+from django.test import client
+
+def setup_database():
+    management.call_command('syncdb', interactive=False, verbosity=0)
+
+def make_request(path='/'):
+    request = client.RequestFactory().get(path)
+    request.user = auth_models.AnonymousUser()
+    request.current_page = None
+    request.session = {}
+    return request
+
+def make_context(path='/', **kwargs):
+    return template.RequestContext(make_request(path), kwargs)
+
+def peak_rss():
+    """
+    Returns peak resident set size of the current process, in kilobytes (on Linux).
+    """
+
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def current_rss():
+    """
+    Returns current resident set size of the current process, in kilobytes (on Linux).
+    """
+
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+
+def percentile(values, percent):
+    """
+    Returns a percentile of sorted values, using the nearest-rank method.
+    """
+
+    if not values:
+        return 0.0
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+def count_queries(f):
+    """
+    Returns the number of database queries made by one call of `f`.
+    """
+
+    debug = settings.DEBUG
+    # Django records queries only in debug mode
+    settings.DEBUG = True
+    try:
+        start = len(connection.queries)
+        f()
+        return len(connection.queries) - start
+    finally:
+        settings.DEBUG = debug
+
+def measure(f, iterations, warmup=1):
+    """
+    Calls `f` `iterations` times (after `warmup` calls) and returns a dict with throughput,
+    latency percentiles (in milliseconds) and queries per call.
+    """
+
+    for i in range(warmup):
+        f()
+
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        f()
+        timings.append(time.time() - start)
+    timings.sort()
+
+    return {
+        'throughput': len(timings) / (sum(timings) or float('inf')),
+        'p50': percentile(timings, 50) * 1000,
+        'p90': percentile(timings, 90) * 1000,
+        'p99': percentile(timings, 99) * 1000,
+        'queries': count_queries(f),
+    }
@@ -0,0 +1,130 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import cache as django_cache
+
+CACHE_PREFIX = 'cmsplugin_markup_tracwiki'
+CLOCK_KEY = '%s:clock' % (CACHE_PREFIX,)
+
+# Cache backend modules (or their parts) of backends shared between processes
+SHARED_BACKENDS = ('memcache', 'pylibmc', 'redis', 'django.core.cache.backends.db', 'django.core.cache.backends.filebased')
+
+_cache = None
+
+def is_enabled():
+    return getattr(settings, 'CMS_MARKUP_TRAC_CACHE', False)
+
+def is_shared():
+    """
+    Returns if the cache backend is shared between processes (and not, for example, in process memory).
+    """
+
+    module = get_cache().__class__.__module__
+    return any(name in module for name in SHARED_BACKENDS)
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        backend = getattr(settings, 'CMS_MARKUP_TRAC_CACHE_BACKEND', None)
+        if backend:
+            _cache = django_cache.get_cache(backend)
+        else:
+            _cache = django_cache.cache
+    return _cache
+
+def get_timeout():
+    return getattr(settings, 'CMS_MARKUP_TRAC_CACHE_TIMEOUT', None)
+
+def make_key(kind, *parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        digest.update(str(part))
+        digest.update('\0')
+    return '%s:%s:%s' % (CACHE_PREFIX, kind, digest.hexdigest())
+
+def dependency_key(realm, id=None):
+    """
+    Dependency keys identify objects a rendered content depends on. `id` of `None` stands for the whole realm
+    and is used when a link could not be resolved (so that any new object in the realm can resolve it).
+    """
+
+    return '%s:dependency:%s:%s' % (CACHE_PREFIX, realm, id if id is not None else '*')
+
+def _initial_clock():
+    # An evicted clock starts after versions it has given, so that an evicted version key never matches a stored one
+    return int(time.time() * 1000)
+
+def get_clock():
+    """
+    Returns the current value of the version clock, to be read before rendering and passed to `set_rendered`.
+    """
+
+    clock = get_cache().get(CLOCK_KEY)
+    if clock is None:
+        return _initial_clock()
+    return clock
+
+def _new_version():
+    cache = get_cache()
+    try:
+        return cache.incr(CLOCK_KEY)
+    except ValueError:
+        cache.add(CLOCK_KEY, _initial_clock(), get_timeout())
+        return cache.incr(CLOCK_KEY)
+
+def get_versions(dependencies, since=None):
+    """
+    Returns current versions of dependencies, or `None` if any of them changed after `since`, a value of
+    `get_clock`.
+    """
+
+    cache = get_cache()
+    keys = [dependency_key(realm, id) for (realm, id) in dependencies]
+    versions = cache.get_many(keys)
+    if since is not None:
+        for version in versions.itervalues():
+            if version > since:
+                return None
+    for key in keys:
+        if key not in versions:
+            versions[key] = _new_version()
+            cache.set(key, versions[key], get_timeout())
+    return versions
+
+def invalidate(realm, id=None):
+    get_cache().set(dependency_key(realm, id), _new_version(), get_timeout())
+
+def get_rendered(key):
+    """
+    Returns a cached rendered entry for a given key if it exists and none of its dependencies changed since.
+    """
+
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    versions = cache.get_many(entry['versions'].keys())
+    if versions != entry['versions']:
+        return None
+    return entry
+
+def set_rendered(key, html, scripts, links, dependencies, since, **extra):
+    """
+    Stores a rendered entry for a given key, unless any of its dependencies changed after `since`, a value of
+    `get_clock` read before rendering (as then the entry might already be stale).
+    """
+
+    versions = get_versions(dependencies, since)
+    if versions is None:
+        return
+    entry = {
+        'html': html,
+        'scripts': scripts,
+        'links': links,
+        'versions': versions,
+    }
+    entry.update(extra)
+    get_cache().set(key, entry, get_timeout())
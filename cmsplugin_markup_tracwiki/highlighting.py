@@ -0,0 +1,78 @@
+import functools
+import hashlib
+
+from genshi import core as genshi_core
+
+from trac.web import chrome as trac_chrome
+
+from django.conf import settings
+
+from cmsplugin_markup_tracwiki import caching
+from cmsplugin_markup_tracwiki import utils
+
+HIGHLIGHT_CACHE_SIZE = 500
+
+# Highlighted code, keyed by lexer, content hash and style
+_highlight_cache = utils.LRUCache(HIGHLIGHT_CACHE_SIZE)
+
+def clear_highlight_cache():
+    _highlight_cache.clear()
+
+def _cached_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context, mimetype, content, filename=None, rev=None):
+        if self._types is None:
+            self._init_types()
+        try:
+            language = self._types[mimetype.split(';', 1)[0]][0]
+        except KeyError:
+            language = None
+        if not content or language is None:
+            return render(self, context, mimetype, content, filename, rev)
+
+        style = context.req.session.get('pygments_style', self.default_style)
+        if isinstance(content, unicode):
+            digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        else:
+            digest = hashlib.sha1(content).hexdigest()
+        key = (language, digest, style)
+
+        html = _highlight_cache.get(key)
+        shared = getattr(settings, 'CMS_MARKUP_TRAC_HIGHLIGHT_CACHE', False) and caching.is_enabled()
+        if html is None and shared:
+            shared_key = caching.make_key('highlight', self._pygments_version, *key)
+            html = caching.get_cache().get(shared_key)
+            if html is not None:
+                _highlight_cache.set(key, html)
+
+        if html is None:
+            # Adds the stylesheet, too
+            html = genshi_core.Stream(render(self, context, mimetype, content, filename, rev)).render('xhtml', encoding=None)
+            _highlight_cache.set(key, html)
+            if shared:
+                caching.get_cache().set(shared_key, html, caching.get_timeout())
+        else:
+            trac_chrome.add_stylesheet(context.req, '/pygments/%s.css' % (style,))
+
+        # A list of lines works both with and without annotations
+        return [genshi_core.Markup(line) for line in html.split(u'\n')]
+    return wrapper
+
+def patch_pygments_renderer():
+    """
+    Makes Trac's Pygments renderer reuse previously highlighted code. Has to be called after
+    `trac.mimeview.pygments` has been imported.
+    """
+
+    try:
+        from trac.mimeview import pygments as trac_pygments
+    except ImportError:
+        return
+
+    renderer = trac_pygments.PygmentsRenderer
+    if getattr(renderer.render, 'highlight_cache', False):
+        return
+    render = _cached_render(renderer.render.im_func)
+    render.highlight_cache = True
+    renderer._pygments_version = getattr(trac_pygments.pygments, '__version__', None)
+    renderer.render = render
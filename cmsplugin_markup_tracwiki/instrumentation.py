@@ -0,0 +1,141 @@
+from __future__ import with_statement
+
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core import exceptions
+from django.db import connection
+from django.utils import importlib
+
+logger = logging.getLogger('cmsplugin_markup_tracwiki')
+
+_sinks = None
+_collecting = threading.local()
+
+def get_sinks():
+    """
+    Returns stats sinks configured with `CMS_MARKUP_TRAC_STATS_SINKS` setting, a list of dotted paths
+    to callables which receive stats of each render as a dict.
+    """
+
+    global _sinks
+    if _sinks is None:
+        sinks = []
+        for path in getattr(settings, 'CMS_MARKUP_TRAC_STATS_SINKS', ()):
+            module, attr = path.rsplit('.', 1)
+            try:
+                sinks.append(getattr(importlib.import_module(module), attr))
+            except (ImportError, AttributeError) as e:
+                raise exceptions.ImproperlyConfigured("Error importing stats sink %s: %s" % (path, e))
+        _sinks = sinks
+    return _sinks
+
+def start_collecting():
+    """
+    Starts collecting stats of renders in the current thread, until `stop_collecting` is called.
+    """
+
+    _collecting.renders = []
+
+def stop_collecting():
+    """
+    Stops collecting stats of renders in the current thread and returns those collected.
+    """
+
+    renders = getattr(_collecting, 'renders', [])
+    _collecting.renders = None
+    return renders
+
+def is_enabled():
+    return bool(get_sinks()) or getattr(_collecting, 'renders', None) is not None
+
+def new_stats():
+    """
+    Returns a new stats object for a render, or `None` if instrumentation is not enabled.
+    """
+
+    if not is_enabled():
+        return None
+    return RenderStats()
+
+def record(stats):
+    if stats is None:
+        return
+    data = stats.as_dict()
+    for sink in get_sinks():
+        sink(data)
+    renders = getattr(_collecting, 'renders', None)
+    if renders is not None:
+        renders.append(data)
+
+def log_sink(data):
+    """
+    A stats sink which logs stats of each render.
+    """
+
+    logger.debug("Rendered %(size)d characters in %(total).3f s (prepare %(prepare).3f s, format %(format).3f s, cached %(cached)s), macros %(macros)r, links %(links)r" % data)
+
+def _query_count():
+    # Django records queries only in debug mode
+    if settings.DEBUG:
+        return len(connection.queries)
+    return None
+
+@contextlib.contextmanager
+def _not_measured():
+    yield
+
+def measure(stats, name, group=None):
+    """
+    Returns a context manager measuring time and queries of its block into `stats`, under `name` in `group`
+    (`None`, `'macros'` or `'links'`). Does nothing if `stats` is `None`.
+    """
+
+    if stats is None:
+        return _not_measured()
+    return stats.measure(name, group)
+
+class RenderStats(object):
+    """
+    Timings and query counts of one render.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.timings = {}
+        self.macros = {}
+        self.links = {}
+        self.size = 0
+        self.cached = False
+
+    @contextlib.contextmanager
+    def measure(self, name, group=None):
+        start = time.time()
+        queries = _query_count()
+        try:
+            yield
+        finally:
+            if group is None:
+                entry = self.timings.setdefault(name, {'time': 0.0, 'calls': 0, 'queries': 0})
+            else:
+                entry = getattr(self, group).setdefault(name, {'time': 0.0, 'calls': 0, 'queries': 0})
+            entry['time'] += time.time() - start
+            entry['calls'] += 1
+            if queries is not None:
+                entry['queries'] += _query_count() - queries
+
+    def as_dict(self):
+        return {
+            'total': time.time() - self.start,
+            'prepare': self.timings.get('prepare', {}).get('time', 0.0),
+            'prefetch': self.timings.get('prefetch', {}).get('time', 0.0),
+            'format': self.timings.get('format', {}).get('time', 0.0),
+            'queries': sum(entry['queries'] for entry in self.timings.itervalues()),
+            'macros': self.macros,
+            'links': self.links,
+            'size': self.size,
+            'cached': self.cached,
+        }
@@ -5,11 +5,31 @@ from django.template import defaulttags
 
 from cms.models import pluginmodel as plugin_models
 
+from cmsplugin_markup_tracwiki import parallel
+from cmsplugin_markup_tracwiki import utils
+
+COMPILED_TAGS_CACHE_SIZE = 500
+
+# Compiled nodes are stateless during rendering so they can be reused
+_compiled_tags = utils.LRUCache(COMPILED_TAGS_CACHE_SIZE)
+
 class DjangoTagMacroBase(macros.WikiMacroBase):
+    # Does the output depend only on macro arguments?
+    cacheable = True
+
     def expand_macro(self, formatter, name, content):
-        tag = getattr(defaulttags, self.django_tag_name)
-        node = tag(template.Parser(''), template.Token(template.TOKEN_BLOCK, "%s %s" % (self.django_tag_name, content)))
-        return node.render(formatter.req.django_context)
+        if not self.cacheable:
+            formatter.req.render_cacheable = False
+        return self._get_node(content).render(formatter.req.django_context)
+
+    def _get_node(self, content):
+        key = (self.django_tag_name, content)
+        node = _compiled_tags.get(key)
+        if node is None:
+            tag = getattr(defaulttags, self.django_tag_name)
+            node = tag(template.Parser(''), template.Token(template.TOKEN_BLOCK, "%s %s" % (self.django_tag_name, content)))
+            _compiled_tags.set(key, node)
+        return node
 
     def get_macros(self):
         yield self.django_tag_name
@@ -31,6 +51,8 @@ class URLMacro(DjangoTagMacroBase):
     """
 
     django_tag_name = 'url'
+    # Arguments can be resolved from the template context
+    cacheable = False
 
 class NowMacro(DjangoTagMacroBase):
     """Wrapper around Django's `now` template tag.
@@ -49,6 +71,7 @@ class NowMacro(DjangoTagMacroBase):
     """
  
     django_tag_name = 'now'
+    cacheable = False
 
 class CMSPluginMacro(macros.WikiMacroBase):
     """Macro which renders Django CMS plugin.
@@ -68,8 +91,16 @@ class CMSPluginMacro(macros.WikiMacroBase):
         context = formatter.req.django_context
         placeholder = formatter.req.django_placeholder
         try:
-            plugin = plugin_models.CMSPlugin.objects.get(pk=content.strip())
+            plugin_id = int(content.strip())
+            # Plugins are prefetched in Markup.parse
+            plugin = formatter.req.django_plugins.get(plugin_id) or plugin_models.CMSPlugin.objects.get(pk=plugin_id)
+            formatter.req.render_dependencies.add(('plugin', plugin.pk))
+            # Plugin output can depend on the user (or contain a CSRF token) and on objects it does not report
+            formatter.req.render_cacheable = False
             plugin._render_meta.text_enabled = True
+            if parallel.is_enabled(request):
+                # Output is spliced in when the whole content is formatted
+                return parallel.submit(formatter.req, plugin, placeholder, content)
             return plugin.render_plugin(context, placeholder)
         except Exception as e:
             # TODO: Log
@@ -0,0 +1,44 @@
+import os
+import shutil
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management import base
+
+from cmsplugin_markup_tracwiki import tracwiki
+
+class Command(base.NoArgsCommand):
+    help = "Copies static files of Trac components into STATIC_ROOT so that they can be served without Django."
+
+    option_list = base.NoArgsCommand.option_list + (
+        make_option('--destination', '-d', dest='destination', default=None,
+            help="Directory to copy files into. Default is 'tracwiki' directory in STATIC_ROOT."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        destination = options.get('destination')
+        if not destination:
+            static_root = getattr(settings, 'STATIC_ROOT', None)
+            if not static_root:
+                raise base.CommandError("STATIC_ROOT is not set, use --destination option.")
+            destination = os.path.join(static_root, 'tracwiki')
+
+        copied = 0
+        # Earlier providers take precedence, as when serving files
+        for (prefix, directory) in reversed(tracwiki.get_htdocs_dirs(tracwiki.get_environment())):
+            if not os.path.isdir(directory):
+                continue
+            for (dirpath, dirnames, filenames) in os.walk(directory):
+                target_dir = os.path.join(destination, prefix, os.path.relpath(dirpath, directory))
+                if not os.path.isdir(target_dir):
+                    os.makedirs(target_dir)
+                for filename in filenames:
+                    shutil.copy2(os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+                    copied += 1
+            if verbosity >= 2:
+                self.stdout.write("Copied '%s' files from '%s'.\n" % (prefix, directory))
+
+        if verbosity >= 1:
+            self.stdout.write("%d files copied to '%s'.\n" % (copied, destination))
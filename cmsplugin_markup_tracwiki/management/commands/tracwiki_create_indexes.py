@@ -0,0 +1,33 @@
+from django.core.management import base
+from django.db import connection, transaction, utils as db_utils
+
+from cmsplugin_markup_tracwiki import tracwiki
+
+class Command(base.NoArgsCommand):
+    help = "Creates database indexes on django-filer fields files are looked up by when resolving filer links."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        if not tracwiki.USING_FILER:
+            raise base.CommandError("django-filer is not in INSTALLED_APPS.")
+
+        model = tracwiki.filer_models.File
+        table = model._meta.db_table
+        qn = connection.ops.quote_name
+
+        for field in ('sha1',) + tracwiki.FILE_LOOKUP_FIELDS:
+            column = model._meta.get_field(field).column
+            index = '%s_tracwiki_%s' % (table, column)
+            cursor = connection.cursor()
+            try:
+                cursor.execute('CREATE INDEX %s ON %s (%s)' % (qn(index), qn(table), qn(column)))
+            except db_utils.DatabaseError as e:
+                transaction.rollback_unless_managed()
+                # Probably it already exists
+                if verbosity >= 1:
+                    self.stdout.write("Index '%s' not created: %s\n" % (index, e))
+            else:
+                transaction.commit_unless_managed()
+                if verbosity >= 1:
+                    self.stdout.write("Index '%s' created.\n" % (index,))
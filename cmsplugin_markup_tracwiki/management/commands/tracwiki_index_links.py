@@ -0,0 +1,24 @@
+from django.core.management import base
+
+from cmsplugin_markup import models as markup_models
+
+from cmsplugin_markup_tracwiki import models as tracwiki_models
+from cmsplugin_markup_tracwiki import tracwiki
+
+class Command(base.NoArgsCommand):
+    help = "Fills the link index with links in Trac wiki content of all plugins."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        count = 0
+        for plugin in markup_models.MarkupField.objects.filter(markup=tracwiki.Markup.identifier).iterator():
+            tracwiki_models.update_link_index(plugin)
+            count += 1
+
+        # Plugins which are not using Trac wiki markup (anymore) do not have links
+        stale = tracwiki_models.Link.objects.exclude(source__in=markup_models.MarkupField.objects.filter(markup=tracwiki.Markup.identifier).values('pk'))
+        stale.delete()
+
+        if verbosity >= 1:
+            self.stdout.write("Indexed links of %s plugins.\n" % (count,))
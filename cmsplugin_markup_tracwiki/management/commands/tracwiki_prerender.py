@@ -0,0 +1,167 @@
+import multiprocessing
+import time
+
+from optparse import make_option
+
+from django import template
+from django.contrib.auth import models as auth_models
+from django.contrib.sites import models as sites_models
+from django.core.management import base
+from django.db import connection
+from django.test import client
+from django.utils import translation
+
+from cms import models as cms_models
+
+from cmsplugin_blog import models as blog_models
+
+from cmsplugin_markup import models as markup_models
+
+from cmsplugin_markup_tracwiki import caching
+from cmsplugin_markup_tracwiki import tracwiki
+
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+}
+
+def get_domains(plugin):
+    """
+    Returns domains of sites displaying the plugin: of its page or of pages blog is hooked to (for blog entries).
+    """
+
+    placeholder = plugin.placeholder
+    if placeholder is not None:
+        pages = list(placeholder.page_set.select_related('site')[:1])
+        if pages:
+            return [pages[0].site.domain]
+        if blog_models.Entry.objects.filter(placeholders=placeholder).exists():
+            domains = cms_models.Title.objects.filter(application_urls='BlogApphook', language=plugin.language).values_list('page__site__domain', flat=True)
+            domains = sorted(set(domains))
+            if domains:
+                return domains
+    return [sites_models.Site.objects.get_current().domain]
+
+def get_current_page(placeholder, domain, language):
+    """
+    Returns the page requests displaying content of the placeholder have as the current page.
+    """
+
+    if placeholder is None:
+        return None
+    pages = list(placeholder.page_set.all()[:1])
+    if pages:
+        return pages[0]
+    if blog_models.Entry.objects.filter(placeholders=placeholder).exists():
+        # Blog entries are displayed under the page the blog is hooked to, preferably on the same site
+        titles = cms_models.Title.objects.select_related('page').filter(application_urls='BlogApphook', language=language)
+        for candidates in (titles.filter(page__site__domain=domain), titles):
+            candidates = list(candidates[:1])
+            if candidates:
+                return candidates[0].page
+    return None
+
+def make_request(domain, plugin, scheme='http', port=None):
+    """
+    Returns a fake anonymous request displaying the plugin, as it would come to a site with the domain
+    using the scheme and the port.
+    """
+
+    port = port or DEFAULT_PORTS[scheme]
+    host = domain
+    if ':' not in domain and port != DEFAULT_PORTS[scheme]:
+        host = '%s:%s' % (domain, port)
+
+    request = client.RequestFactory().get('/', **{
+        'HTTP_HOST': host,
+        'SERVER_PORT': str(port),
+        'wsgi.url_scheme': scheme,
+    })
+    request.user = auth_models.AnonymousUser()
+    request.session = {}
+    request.current_page = get_current_page(plugin.placeholder, domain, plugin.language)
+    return request
+
+def render_plugin(item):
+    """
+    Renders a plugin for a site with a fake anonymous request, filling the render cache.
+
+    Returns a tuple of the item, rendering time and an error message (or `None`).
+    """
+
+    (domain, plugin_id, scheme, port) = item
+    start = time.time()
+    try:
+        plugin = markup_models.MarkupField.objects.get(pk=plugin_id)
+        translation.activate(plugin.language)
+
+        request = make_request(domain, plugin, scheme, port)
+        context = template.RequestContext(request, {
+            'object': plugin,
+            'placeholder': plugin.placeholder,
+        })
+        tracwiki.Markup().parse(plugin.body, context, plugin.placeholder)
+        error = None
+    except Exception as e:
+        error = u'%s: %s' % (e.__class__.__name__, e)
+    finally:
+        translation.deactivate()
+    return (item, time.time() - start, error)
+
+class Command(base.NoArgsCommand):
+    help = "Renders all Trac wiki content (of pages and blog entries, in all languages) for sites displaying it to fill the render cache."
+
+    option_list = base.NoArgsCommand.option_list + (
+        make_option('--processes', '-p', dest='processes', type='int', default=None,
+            help="Number of processes to render with. Default is the number of CPUs."),
+        make_option('--slowest', dest='slowest', type='int', default=10,
+            help="Number of slowest documents to report. Default is 10."),
+        make_option('--scheme', dest='scheme', type='choice', choices=DEFAULT_PORTS.keys(), default='http',
+            help="Scheme sites are served with. Default is http."),
+        make_option('--host', dest='hosts', action='append', default=None,
+            help="Domain to render all content for, can be given multiple times. Default are domains of sites displaying content."),
+        make_option('--port', dest='port', type='int', default=None,
+            help="Port sites are served on. Default is the default port of the scheme."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        if not caching.is_enabled():
+            raise base.CommandError("Render cache is not enabled, set CMS_MARKUP_TRAC_CACHE setting.")
+        if not caching.is_shared():
+            # Workers would fill their own memory, which is discarded when they exit
+            raise base.CommandError("Render cache backend is not shared between processes, use for example memcached, database or file system backend.")
+
+        # Blog entries' content is stored in the same plugins as pages' content, language is stored with a plugin
+        plugins = markup_models.MarkupField.objects.filter(markup=tracwiki.Markup.identifier).select_related('placeholder')
+        items = []
+        for plugin in plugins:
+            for domain in options.get('hosts') or get_domains(plugin):
+                items.append((domain, plugin.pk, options.get('scheme'), options.get('port')))
+
+        # Workers open their own database connections
+        connection.close()
+
+        start = time.time()
+        pool = multiprocessing.Pool(options.get('processes'))
+        try:
+            results = []
+            for (item, duration, error) in pool.imap_unordered(render_plugin, items):
+                results.append((duration, item))
+                if error:
+                    self.stderr.write("Error rendering plugin %s for '%s': %s\n" % (item[1], item[0], error))
+                elif verbosity >= 2:
+                    self.stdout.write("Rendered plugin %s for '%s' in %.3f s.\n" % (item[1], item[0], duration))
+        finally:
+            pool.close()
+            pool.join()
+        total = time.time() - start
+
+        if verbosity >= 1:
+            self.stdout.write("Rendered %d documents in %.3f s (%.3f s of rendering).\n" % (len(results), total, sum(d for (d, i) in results)))
+            results.sort(reverse=True)
+            if results and options.get('slowest'):
+                self.stdout.write("Slowest documents:\n")
+                for (duration, (domain, plugin_id, scheme, port)) in results[:options.get('slowest')]:
+                    self.stdout.write("  plugin %s for '%s': %.3f s\n" % (plugin_id, domain, duration))
@@ -0,0 +1,17 @@
+from cmsplugin_markup_tracwiki import tracwiki
+
+class CurrentRequestMiddleware(object):
+    """
+    Makes the current request available to Trac wiki rendering which is not given a context,
+    like when plugin content is rendered while being saved.
+    """
+
+    def process_request(self, request):
+        tracwiki.set_current_request(request)
+
+    def process_response(self, request, response):
+        tracwiki.set_current_request(None)
+        return response
+
+    def process_exception(self, request, exception):
+        tracwiki.set_current_request(None)
@@ -0,0 +1,262 @@
+from django.conf import settings
+from django.db import models, transaction, utils as db_utils
+from django.db.models import signals
+from django.utils import simplejson, translation
+
+from django.contrib.sites import models as sites_models
+
+from cms import models as cms_models
+
+from cmsplugin_blog import models as blog_models
+
+from cmsplugin_markup import models as markup_models
+
+from cmsplugin_markup_tracwiki import caching
+from cmsplugin_markup_tracwiki import tracwiki
+
+class Link(models.Model):
+    """
+    Link from Trac wiki content of a plugin to a Django CMS page, django-filer file, cmsplugin-blog entry
+    or an embedded plugin, identified by its realm and target as written in the content.
+    """
+
+    source = models.ForeignKey(cms_models.CMSPlugin, related_name='tracwiki_links')
+    realm = models.CharField(max_length=20)
+    target = models.CharField(max_length=tracwiki.LINK_TARGET_MAX_LENGTH, db_index=True)
+
+    class Meta:
+        unique_together = (('source', 'realm', 'target'),)
+
+    def __unicode__(self):
+        return u'%s -> %s:%s' % (self.source_id, self.realm, self.target)
+
+class CompiledContent(models.Model):
+    """
+    Compiled Trac wiki content (see `tracwiki.Markup.compile`), stored durably with the cache backend in front of it.
+    """
+
+    key = models.CharField(max_length=100, unique=True)
+    plugin = models.ForeignKey(cms_models.CMSPlugin, null=True, blank=True, related_name='tracwiki_compiled')
+    content = models.TextField()
+
+    def __unicode__(self):
+        return self.key
+
+class Classification(models.Model):
+    """
+    Value of plugin's "Render every time" option as set by detection of static content, or `None` if it was
+    set by an editor, whose choice is then kept.
+    """
+
+    plugin = models.OneToOneField(cms_models.CMSPlugin, related_name='tracwiki_classification')
+    dynamic = models.NullBooleanField()
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.plugin_id, self.dynamic)
+
+def store_compiled(key, compiled, plugin_id=None):
+    # Holes are keyed by integers which JSON does not support
+    content = simplejson.dumps(dict(compiled, holes=compiled['holes'].items()))
+    if CompiledContent.objects.filter(key=key).update(content=content, plugin=plugin_id):
+        return
+    sid = transaction.savepoint()
+    try:
+        CompiledContent.objects.create(key=key, content=content, plugin_id=plugin_id)
+    except db_utils.IntegrityError:
+        # Stored meanwhile by somebody else
+        transaction.savepoint_rollback(sid)
+    else:
+        transaction.savepoint_commit(sid)
+
+def load_compiled(key):
+    try:
+        content = CompiledContent.objects.get(key=key).content
+    except CompiledContent.DoesNotExist:
+        return None
+    compiled = simplejson.loads(content)
+    compiled['holes'] = dict((index, tuple(hole)) for (index, hole) in compiled['holes'])
+    return compiled
+
+def is_link_index_enabled():
+    return getattr(settings, 'CMS_MARKUP_TRAC_LINK_INDEX', False)
+
+def update_link_index(plugin):
+    """
+    Updates the link index with links in the plugin's content.
+    """
+
+    if plugin.markup == tracwiki.Markup.identifier:
+        targets = tracwiki.Markup().link_targets(plugin.body)
+    else:
+        targets = set()
+
+    existing = set(Link.objects.filter(source=plugin.pk).values_list('realm', 'target'))
+    for (realm, target) in existing - targets:
+        Link.objects.filter(source=plugin.pk, realm=realm, target=target).delete()
+    for (realm, target) in targets - existing:
+        Link.objects.create(source_id=plugin.pk, realm=realm, target=target)
+
+def get_link_targets(instance):
+    """
+    Returns a realm and a list of targets links to the object can use.
+    """
+
+    if isinstance(instance, cms_models.Page):
+        return ('cms', [instance.reverse_id] if instance.reverse_id else [])
+    elif isinstance(instance, blog_models.EntryTitle):
+        return ('blog', [instance.slug, u'%s:%s' % (instance.language, instance.slug)])
+    elif isinstance(instance, cms_models.CMSPlugin):
+        return ('plugin', [str(instance.pk)])
+    elif tracwiki.USING_FILER and isinstance(instance, tracwiki.filer_models.File):
+        targets = []
+        for field in ('sha1',) + tracwiki.FILE_LOOKUP_FIELDS:
+            value = instance.file.name if field == 'file' else getattr(instance, field)
+            if value:
+                targets.append(value)
+        return ('filer', targets)
+    return (None, [])
+
+def get_linking_plugins(instance):
+    """
+    Returns IDs of plugins whose content links to the object (what links here).
+    """
+
+    (realm, targets) = get_link_targets(instance)
+    if not targets:
+        return []
+    return list(Link.objects.filter(realm=realm, target__in=targets).values_list('source', flat=True).distinct())
+
+def update_links(sender, instance, **kwargs):
+    if is_link_index_enabled():
+        update_link_index(instance)
+
+def invalidate_render_cache(sender, instance, **kwargs):
+    """
+    Invalidates rendered content which depends on a changed object.
+    """
+
+    if isinstance(instance, (cms_models.Page, cms_models.Title, blog_models.Entry, blog_models.EntryTitle)) or \
+            (tracwiki.USING_FILER and isinstance(instance, tracwiki.filer_models.File)):
+        tracwiki.clear_link_cache()
+
+    if not caching.is_enabled():
+        return
+
+    if isinstance(instance, cms_models.Page):
+        caching.invalidate('cms', instance.pk)
+        caching.invalidate('cms')
+    elif isinstance(instance, cms_models.Title):
+        caching.invalidate('cms', instance.page_id)
+        caching.invalidate('cms')
+    elif isinstance(instance, blog_models.EntryTitle):
+        caching.invalidate('blog', instance.pk)
+        caching.invalidate('blog')
+    elif isinstance(instance, blog_models.Entry):
+        # Entry publication date is used in URLs of its titles
+        for pk in instance.entrytitle_set.values_list('pk', flat=True):
+            caching.invalidate('blog', pk)
+    elif isinstance(instance, cms_models.CMSPlugin):
+        caching.invalidate('plugin', instance.pk)
+    elif tracwiki.USING_FILER and isinstance(instance, tracwiki.filer_models.File):
+        caching.invalidate('filer', instance.pk)
+        caching.invalidate('filer')
+
+    if is_link_index_enabled():
+        # Indexed content does not depend on whole realms, but links which could now resolve differently
+        for source_id in get_linking_plugins(instance):
+            caching.invalidate('source', source_id)
+
+# Content is not Trac wiki content or detection of static content is disabled
+NOT_CLASSIFIED = object()
+
+def is_classified_automatically(instance):
+    """
+    Returns if plugin's "Render every time" option has not been set by an editor.
+    """
+
+    try:
+        classified = Classification.objects.get(plugin=instance.pk).dynamic
+    except Classification.DoesNotExist:
+        # Option has been left at its default
+        return instance.dynamic == markup_models.MarkupField._meta.get_field('dynamic').default
+    return classified is not None and instance.dynamic == classified
+
+def classify_content(sender, instance, **kwargs):
+    """
+    Marks content without request-dependent constructs as static, so that its output rendered when saving
+    is displayed instead of rendering it for every request.
+    """
+
+    instance._tracwiki_classified = NOT_CLASSIFIED
+    if not getattr(settings, 'CMS_MARKUP_TRAC_DETECT_STATIC', False) or instance.markup != tracwiki.Markup.identifier:
+        return
+
+    instance._tracwiki_classified = None
+    if not is_classified_automatically(instance):
+        return
+
+    markup = tracwiki.Markup()
+    instance.dynamic = markup.is_text_dynamic(instance.body)
+    instance._tracwiki_classified = instance.dynamic
+    # Output rendered when saving is reused if it is in content's language
+    if instance.dynamic or instance.language == translation.get_language():
+        return
+
+    # Content was rendered when saving in the current language, but it is displayed in its language
+    language = translation.get_language()
+    translation.activate(instance.language)
+    try:
+        instance.body_html = markup.parse(instance.body)
+        instance.body_scripts = '\n'.join(markup.get_scripts())
+        instance.body_stylesheets = '\n'.join(markup.get_stylesheets())
+    finally:
+        translation.activate(language)
+
+def store_classification(sender, instance, **kwargs):
+    """
+    Records who set plugin's "Render every time" option.
+    """
+
+    classified = getattr(instance, '_tracwiki_classified', NOT_CLASSIFIED)
+    if classified is NOT_CLASSIFIED:
+        return
+    if not Classification.objects.filter(plugin=instance.pk).update(dynamic=classified):
+        Classification.objects.create(plugin_id=instance.pk, dynamic=classified)
+
+def compile_content(sender, instance, **kwargs):
+    """
+    Compiles saved content so that it does not have to be compiled when first rendered.
+    """
+
+    if not getattr(settings, 'CMS_MARKUP_TRAC_COMPILE', False):
+        return
+    # Content changed, so previously compiled content is not used anymore
+    CompiledContent.objects.filter(plugin=instance.pk).delete()
+    if instance.markup != tracwiki.Markup.identifier:
+        return
+    # Compiling requires a request, otherwise content is compiled when first rendered
+    if tracwiki._get_django_request() is None:
+        return
+    # Content is rendered in its language
+    language = translation.get_language()
+    translation.activate(instance.language)
+    try:
+        tracwiki.Markup().compile(instance.body, plugin_id=instance.pk)
+    finally:
+        translation.activate(language)
+
+def clear_href_caches(sender, instance, **kwargs):
+    tracwiki.clear_href_caches()
+
+signals.post_save.connect(clear_href_caches, sender=sites_models.Site, dispatch_uid='cmsplugin_markup_tracwiki.site_post_save')
+signals.post_delete.connect(clear_href_caches, sender=sites_models.Site, dispatch_uid='cmsplugin_markup_tracwiki.site_post_delete')
+
+signals.post_save.connect(invalidate_render_cache, dispatch_uid='cmsplugin_markup_tracwiki.post_save')
+signals.pre_save.connect(classify_content, sender=markup_models.MarkupField, dispatch_uid='cmsplugin_markup_tracwiki.markupfield_pre_save')
+signals.post_save.connect(store_classification, sender=markup_models.MarkupField, dispatch_uid='cmsplugin_markup_tracwiki.markupfield_post_save_classification')
+signals.post_save.connect(update_links, sender=markup_models.MarkupField, dispatch_uid='cmsplugin_markup_tracwiki.markupfield_post_save_links')
+signals.post_save.connect(compile_content, sender=markup_models.MarkupField, dispatch_uid='cmsplugin_markup_tracwiki.markupfield_post_save')
+signals.post_delete.connect(invalidate_render_cache, dispatch_uid='cmsplugin_markup_tracwiki.post_delete')
+
+if getattr(settings, 'CMS_MARKUP_TRAC_WARM_ENVIRONMENT', False):
+    tracwiki.get_environment().load_lazy_components()
@@ -0,0 +1,89 @@
+from django import template
+from django.utils.translation import ugettext_lazy as _
+
+from debug_toolbar.panels import DebugPanel
+
+from cmsplugin_markup_tracwiki import instrumentation
+
+CONTENT_TEMPLATE = template.Template("""
+{% for render in renders %}
+<h4>Render {{ forloop.counter }}{% if render.cached %} (cached){% endif %}</h4>
+<table>
+    <thead>
+        <tr><th>Total (ms)</th><th>Prepare (ms)</th><th>Prefetch (ms)</th><th>Format (ms)</th><th>Queries</th><th>Size</th></tr>
+    </thead>
+    <tbody>
+        <tr class="row1"><td>{{ render.total_ms|floatformat:2 }}</td><td>{{ render.prepare_ms|floatformat:2 }}</td><td>{{ render.prefetch_ms|floatformat:2 }}</td><td>{{ render.format_ms|floatformat:2 }}</td><td>{{ render.queries }}</td><td>{{ render.size }}</td></tr>
+    </tbody>
+</table>
+{% if render.timings %}
+<table>
+    <thead>
+        <tr><th>Macro or link realm</th><th>Calls</th><th>Time (ms)</th><th>Queries</th></tr>
+    </thead>
+    <tbody>
+        {% for timing in render.timings %}
+        <tr class="{% cycle 'row1' 'row2' %}"><td>{{ timing.name }}</td><td>{{ timing.calls }}</td><td>{{ timing.time_ms|floatformat:2 }}</td><td>{{ timing.queries }}</td></tr>
+        {% endfor %}
+    </tbody>
+</table>
+{% endif %}
+{% endfor %}
+""")
+
+class TracWikiDebugPanel(DebugPanel):
+    """
+    Django Debug Toolbar panel showing timings and query counts of Trac wiki renders in a request.
+    """
+
+    name = 'TracWiki'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        super(TracWikiDebugPanel, self).__init__(*args, **kwargs)
+        self.renders = []
+
+    def nav_title(self):
+        return _("Trac wiki")
+
+    def nav_subtitle(self):
+        return _("%(renders)d renders in %(time).2f ms") % {
+            'renders': len(self.renders),
+            'time': sum(render['total'] for render in self.renders) * 1000,
+        }
+
+    def title(self):
+        return _("Trac wiki renders")
+
+    def url(self):
+        return ''
+
+    def process_request(self, request):
+        instrumentation.start_collecting()
+
+    def process_response(self, request, response):
+        self.renders = instrumentation.stop_collecting()
+
+    def content(self):
+        renders = []
+        for render in self.renders:
+            timings = []
+            for (group, label) in (('macros', "[[%s]]"), ('links', "%s:")):
+                for (name, entry) in sorted(render[group].iteritems()):
+                    timings.append({
+                        'name': label % (name,),
+                        'calls': entry['calls'],
+                        'time_ms': entry['time'] * 1000,
+                        'queries': entry['queries'],
+                    })
+            renders.append({
+                'cached': render['cached'],
+                'total_ms': render['total'] * 1000,
+                'prepare_ms': render['prepare'] * 1000,
+                'prefetch_ms': render['prefetch'] * 1000,
+                'format_ms': render['format'] * 1000,
+                'queries': render['queries'],
+                'size': render['size'],
+                'timings': timings,
+            })
+        return CONTENT_TEMPLATE.render(template.Context({'renders': renders}))
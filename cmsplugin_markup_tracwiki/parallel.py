@@ -0,0 +1,164 @@
+from __future__ import with_statement
+
+import atexit
+import copy
+import logging
+import multiprocessing
+import re
+import threading
+import time
+import uuid
+
+from multiprocessing import pool as multiprocessing_pool
+
+from genshi.builder import tag
+
+from trac.util import text as trac_text
+from trac.wiki import formatter as trac_formatter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import translation
+
+logger = logging.getLogger('cmsplugin_markup_tracwiki')
+
+PLUGIN_TOKEN_RE_PATTERN = r'<!--tracwiki-plugin:[0-9a-f]{32}-->'
+PLUGIN_TOKEN_RE = re.compile(PLUGIN_TOKEN_RE_PATTERN)
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker = threading.local()
+# Database connections of workers, closed when the pool is shut down
+_worker_connections = []
+
+def get_threads():
+    return getattr(settings, 'CMS_MARKUP_TRAC_PLUGIN_THREADS', 0)
+
+def get_timeout():
+    return getattr(settings, 'CMS_MARKUP_TRAC_PLUGIN_TIMEOUT', 30)
+
+def is_enabled(request=None):
+    if get_threads() <= 0:
+        return False
+    # Plugins embedded in plugins rendered by workers are rendered inline, so that workers do not wait on each other
+    if getattr(_worker, 'active', False):
+        return False
+    # Workers use their own database connections and would not see uncommitted changes
+    if any(transaction.is_dirty(using=alias) for alias in connections):
+        return False
+    # Previews and edit mode can show changes of the request itself
+    if request is not None and (request.method != 'GET' or 'edit' in request.GET or 'preview' in request.GET):
+        return False
+    return True
+
+def _init_worker():
+    _worker_connections.extend(connections[alias] for alias in connections)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = multiprocessing_pool.ThreadPool(get_threads(), _init_worker)
+    return _pool
+
+def shutdown():
+    """
+    Stops the pool of workers and closes their database connections.
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            return
+        _pool.close()
+        _pool.join()
+        _pool = None
+        for connection in _worker_connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        del _worker_connections[:]
+
+atexit.register(shutdown)
+
+def _render(plugin, context, placeholder, request, language):
+    from cmsplugin_markup_tracwiki import tracwiki
+
+    _worker.active = True
+    translation.activate(language)
+    try:
+        with tracwiki.django_request_context(request, context):
+            return (plugin.render_plugin(context, placeholder), None)
+    except Exception as e:
+        return (None, (e, trac_text.exception_to_unicode(e, traceback=True)))
+    finally:
+        translation.deactivate()
+        _worker.active = False
+        # Connections are kept open, but transactions have to end so that next renders see new data
+        for alias in connections:
+            transaction.commit_unless_managed(using=alias)
+
+def submit(req, plugin, placeholder, args):
+    """
+    Starts rendering the plugin in a worker thread and returns a token to be replaced with its output by `splice`.
+    """
+
+    # Plugins can modify the context so each gets its own, with a fresh dict for its changes
+    context = copy.copy(req.django_context)
+    context.dicts = context.dicts[:]
+    context.push()
+    result = get_pool().apply_async(_render, (plugin, context, placeholder, req.django_request, translation.get_language()))
+    token = '<!--tracwiki-plugin:%s-->' % (uuid.uuid4().hex,)
+    req.plugin_renders[token] = (result, time.time() + get_timeout(), args)
+    return token
+
+def _in_paragraph(html):
+    # Places output into a paragraph like Trac places output of macros
+    match = re.match(trac_formatter.WikiProcessor._code_block_re, html)
+    if match:
+        if match.group(1) and 'code' in match.group(1):
+            return unicode(tag.span(class_='code-block')(*match.group(2)))
+        return u'</p>%s<p>' % (html,)
+    elif re.match(trac_formatter.WikiProcessor._block_elem_re, html):
+        return u'</p>%s<p>' % (html,)
+    return html
+
+def splice(req, html):
+    """
+    Replaces tokens in the output with outputs of plugins rendered by workers, waiting for them to finish.
+    """
+
+    if not req.plugin_renders:
+        return html
+
+    request = req.django_request
+
+    def _replace(match):
+        render = req.plugin_renders.pop(match.group(0), None)
+        if render is None:
+            return match.group(0)
+        (result, deadline, args) = render
+
+        try:
+            (output, error) = result.get(max(deadline - time.time(), 0))
+        except multiprocessing.TimeoutError as e:
+            (output, error) = (None, (e, u"Rendering timed out after %s seconds" % (get_timeout(),)))
+
+        if error:
+            (e, message) = error
+            # Errors and timeouts can be transient
+            req.render_cacheable = False
+            logger.error("Macro CMSPlugin(%s) failed: %s" % (args, message))
+            # The same as when rendering inline, where Trac catches the exception
+            if (request.user.is_authenticated() and request.user.is_staff) or 'preview' in request.GET:
+                output = trac_formatter._markup_to_unicode(trac_formatter.system_message('Error: Macro CMSPlugin(%s) failed' % (args,), e))
+            else:
+                output = u''
+
+        if not output:
+            return u''
+        return _in_paragraph(trac_text.to_unicode(output))
+
+    return PLUGIN_TOKEN_RE.sub(_replace, html)
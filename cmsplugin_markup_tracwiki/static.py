@@ -0,0 +1,58 @@
+import mimetypes
+import os
+
+from django import http
+from django.conf import settings
+from django.core.servers import basehttp
+from django.utils import http as http_utils
+from django.views import static
+
+def get_max_age():
+    return getattr(settings, 'CMS_MARKUP_TRAC_CHROME_MAX_AGE', 24 * 60 * 60)
+
+def etag_matches(header, etag):
+    """
+    Returns if If-None-Match header value matches the ETag, comparing weakly.
+    """
+
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+def is_not_modified(request, etag, stat):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present (RFC 7232, section 3.3)
+        return etag_matches(if_none_match, etag)
+    return not static.was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size)
+
+def serve_file(request, path):
+    """
+    Streams a static file, supporting conditional GET requests and HEAD requests.
+    """
+
+    stat = os.stat(path)
+    etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+    if is_not_modified(request, etag, stat):
+        response = http.HttpResponseNotModified()
+    else:
+        content_type, encoding = mimetypes.guess_type(path)
+        if request.method == 'HEAD':
+            # Only headers
+            content = ''
+        else:
+            content = basehttp.FileWrapper(open(path, 'rb'))
+        response = http.HttpResponse(content, content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = str(stat.st_size)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['Last-Modified'] = http_utils.http_date(stat.st_mtime)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=%d' % (get_max_age(),)
+    return response
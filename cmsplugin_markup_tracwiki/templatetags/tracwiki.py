@@ -1,10 +1,14 @@
+from __future__ import with_statement
+
 from django import template
 from django.template import defaultfilters
 
+from trac import resource
 from trac.util import html
 from trac.wiki import formatter
 
 from cmsplugin_markup_tracwiki import tracwiki
+from cmsplugin_markup_tracwiki.tracwiki import DjangoComponent, _get_django_request, django_request_context
 
 register = template.Library()
 
@@ -25,7 +29,18 @@ parser = tracwiki.Markup()
 
 @register.simple_tag(takes_context=True)
 def tracwiki_link(context, value):
-     elt = link_parser.extract_link(value.strip(), context)
+     value = value.strip()
+     request = _get_django_request(context=context)
+     with django_request_context(request, context):
+         if request is not None:
+             try:
+                 href = DjangoComponent(link_parser.env).resolve_link(request, context, value)
+             except resource.ResourceNotFound:
+                 # Like a missing link
+                 return value.split(':', 1)[-1]
+             if href is not None:
+                 return href
+         elt = link_parser.extract_link(value, context)
      elt = html.find_element(elt, 'href')
      if elt is not None:
          return elt.attrib.get('href')
@@ -34,4 +49,5 @@ def tracwiki_link(context, value):
 
 @register.simple_tag(takes_context=True)
 def tracwiki(context, value):
-     return parser.parse(value, context)
+     with django_request_context(context.get('request'), context):
+         return parser.parse(value, context)
@@ -7,9 +7,12 @@ import os
 import re
 import string
 import sys
+import threading
+import time
 
 from StringIO import StringIO
 
+from genshi import core as genshi_core
 from genshi.builder import tag
 
 from trac.core import *
@@ -30,14 +33,16 @@ from django import http
 from django import template
 from django.conf import settings
 from django.contrib.sites import models as sites_models
+from django.core import exceptions as django_exceptions
 from django.core import urlresolvers
 from django.core.servers import basehttp
-from django.db.models import Q
+from django.utils import datastructures
 from django.utils import translation as django_translation
 from django.utils import safestring
 
 from cms import models as cms_models
 from cms import utils as cms_utils
+from cms.plugin_pool import plugin_pool
 from cms.utils import moderator
 
 if 'filer' in settings.INSTALLED_APPS:
@@ -50,19 +55,75 @@ from cmsplugin_blog import models as blog_models
 
 from cmsplugin_markup import plugins as markup_plugins
 
+from cmsplugin_markup_tracwiki import caching
+from cmsplugin_markup_tracwiki import highlighting
+from cmsplugin_markup_tracwiki import instrumentation
+from cmsplugin_markup_tracwiki import parallel
+from cmsplugin_markup_tracwiki import static
+from cmsplugin_markup_tracwiki import utils
+
 OBJ_ADMIN_RE_PATTERN = ur'\[\[CMSPlugin\(\s*(\d+)\s*\)\]\]'
 OBJ_ADMIN_RE = re.compile(OBJ_ADMIN_RE_PATTERN)
 
 PLUGIN_EDIT_RE_PATTERN = ur'edit-plugin/(\d+)'
 PLUGIN_EDIT_RE = re.compile(PLUGIN_EDIT_RE_PATTERN)
 
+CHROME_PATH_RE_PATTERN = r'^chrome/(?P<prefix>[^/]+)/+(?P<filename>.+)$'
+CHROME_PATH_RE = re.compile(CHROME_PATH_RE_PATTERN)
+
+SHA1_RE_PATTERN = r'^[0-9a-f]{40}$'
+SHA1_RE = re.compile(SHA1_RE_PATTERN)
+
+# Fields files are looked up by, in order, after SHA-1 hash if ID looks like one
+FILE_LOOKUP_FIELDS = ('original_filename', 'name', 'file')
+
+# Holes in compiled content, with content which is used for heading anchors while compiling
+HOLE_RE_PATTERN = r'<!--tracwiki-hole:(\d+)-->.*?<!--/tracwiki-hole:\1-->'
+HOLE_RE = re.compile(HOLE_RE_PATTERN, re.DOTALL)
+HOLE_MARKER_RE_PATTERN = r'<!--/?tracwiki-hole:\d+-->'
+HOLE_MARKER_RE = re.compile(HOLE_MARKER_RE_PATTERN)
+
+# Macros whose output depends only on the text so they are expanded when compiling
+STATIC_MACROS = ('PageOutline', 'MacroList', 'KnownMimeTypes')
+
+# Version of compiled content format
+COMPILED_VERSION = 1
+
+LINK_TARGET_MAX_LENGTH = 255
+
+# Macros whose output depends on the whole document and not just on the block they are in
+DOCUMENT_MACRO_RE_PATTERN = ur'\[\[PageOutline\b'
+DOCUMENT_MACRO_RE = re.compile(DOCUMENT_MACRO_RE_PATTERN)
+
+# Headings as Trac outputs them
+HEADING_ID_RE_PATTERN = r'<h([1-6]) id="([^"]*)">'
+HEADING_ID_RE = re.compile(HEADING_ID_RE_PATTERN)
+
+# A superset of links to Django resources, used to prefetch them and for the link index,
+# with targets following Trac's rules for [[WikiCreole links]], [bracketed links] and short links
+RESOURCE_LINK_RE_PATTERN = (
+    ur'(?<!!)\[\[\s*(?P<cns>cms|filer|blog):(?P<ctgt>[^|\]]*)'
+    ur'|(?<![!\[])\[(?P<lns>cms|filer|blog):(?P<ltgt>%(quoted)s|[^\]\s]*)'
+    ur'|(?<![-\w!\[.+])(?P<sns>cms|filer|blog):(?P<stgt>%(quoted)s|%(first)s(?:%(middle)s*%(last)s)?)'
+) % {
+    'quoted': wiki.parser.WikiParser.QUOTED_STRING,
+    'first': wiki.parser.WikiParser.SHREF_TARGET_FIRST,
+    'middle': wiki.parser.WikiParser.SHREF_TARGET_MIDDLE,
+    'last': wiki.parser.WikiParser.SHREF_TARGET_LAST,
+}
+RESOURCE_LINK_RE = re.compile(RESOURCE_LINK_RE_PATTERN, re.UNICODE)
+
+# [[macro]] calls and [[WikiCreole links]], and processors of blocks
+MACROLINK_RE_PATTERN = ur'(?<!!)\[\[((?:[^]]|][^]])+)\]\]'
+MACROLINK_RE = re.compile(MACROLINK_RE_PATTERN, re.UNICODE)
+PROCESSOR_RE_PATTERN = ur'^\s*(?:\{\{\{)?\s*#!([\w+-][\w+-/]*)'
+PROCESSOR_RE = re.compile(PROCESSOR_RE_PATTERN, re.UNICODE | re.MULTILINE)
+LINK_SCHEME_RE_PATTERN = ur'^%s:' % (wiki.parser.WikiParser.LINK_SCHEME,)
+LINK_SCHEME_RE = re.compile(LINK_SCHEME_RE_PATTERN)
+
 COMPONENTS = [
     'cmsplugin_markup_tracwiki.tracwiki.DjangoComponent',
     'cmsplugin_markup_tracwiki.tracwiki.DjangoInterWikiMap',
-    'trac.mimeview.pygments',
-    'trac.mimeview.rst',
-    'trac.mimeview.txtl',
-    'trac.mimeview.patch',
     'trac.mimeview.*',
     'trac.wiki.macros.MacroListMacro',
     'trac.wiki.macros.KnownMimeTypesMacro',
@@ -75,17 +136,98 @@ COMPONENTS = [
     'cmsplugin_markup_tracwiki.macros.NowMacro',
 ]
 
+# Renderers are expensive to import so they are loaded only when Mimeview is first used
+LAZY_COMPONENTS = [
+    'trac.mimeview.pygments',
+    'trac.mimeview.rst',
+    'trac.mimeview.txtl',
+    'trac.mimeview.patch',
+]
+
 TRACWIKI_HEADER_OFFSET = 1
 
+def get_plugins(ids, downcast=True):
+    """
+    Returns a map from IDs to plugins with given IDs, fetched with one query. If `downcast` is set, plugins
+    are replaced with their instances, fetched with one query per plugin type.
+    """
+
+    ids = set(int(i) for i in ids)
+    if not ids:
+        return {}
+
+    plugins = dict((plugin.pk, plugin) for plugin in cms_models.CMSPlugin.objects.filter(pk__in=ids))
+
+    if downcast:
+        types = {}
+        for plugin in plugins.itervalues():
+            types.setdefault(plugin.plugin_type, []).append(plugin.pk)
+
+        for (plugin_type, pks) in types.iteritems():
+            try:
+                model = plugin_pool.get_plugin(plugin_type).model
+            except KeyError:
+                # Not registered plugin type, rendering will report it
+                continue
+            if model is cms_models.CMSPlugin:
+                continue
+            for instance in model.objects.filter(pk__in=pks):
+                plugins[instance.pk] = instance
+
+    return plugins
+
+REVERSE_CACHE_SIZE = 1000
+HREF_CACHE_SIZE = 1000
+LINK_CACHE_SIZE = 10000
+DYNAMIC_CACHE_SIZE = 1000
+
+# Reversed URLs are keyed also by URLconf and script prefix so that they follow their changes, and
+# stored together with the resolver they were reversed with, which is replaced by `clear_url_caches`
+# (for example when CMS reloads apphooks)
+_reverse_cache = utils.LRUCache(REVERSE_CACHE_SIZE)
+_href_cache = utils.LRUCache(HREF_CACHE_SIZE)
+
+def clear_href_caches():
+    _reverse_cache.clear()
+    _href_cache.clear()
+
+# Resolved links, for `DjangoComponent.resolve_link`
+_link_cache = utils.LRUCache(LINK_CACHE_SIZE)
+
+def clear_link_cache():
+    _link_cache.clear()
+
+# Results of `Markup.is_text_dynamic`, keyed by text
+_dynamic_cache = utils.LRUCache(DYNAMIC_CACHE_SIZE)
+
+def cached_reverse(viewname, kwargs=None):
+    urlconf = urlresolvers.get_urlconf()
+    resolver = urlresolvers.get_resolver(urlconf)
+    key = (urlconf, urlresolvers.get_script_prefix(), viewname, tuple(sorted((kwargs or {}).items())))
+    cached = _reverse_cache.get(key)
+    if cached is not None and cached[0] is resolver:
+        return cached[1]
+    # Failures are not cached, as URL could become available (for example with a new apphook)
+    url = urlresolvers.reverse(viewname, kwargs=kwargs)
+    _reverse_cache.set(key, (resolver, url))
+    return url
+
+def cached_href(base):
+    href = _href_cache.get(base)
+    if href is None:
+        href = web.href.Href(base)
+        _href_cache.set(base, href)
+    return href
+
 def tracwiki_base_path():
-    return urlresolvers.reverse('cmsplugin_markup_tracwiki', kwargs={'path': ''})
+    return cached_reverse('cmsplugin_markup_tracwiki', kwargs={'path': ''})
 
 def temporary_switch_to_trac_root(f):
     @functools.wraps(f)
     def wrapper(req, *args, **kwargs):
         orig_href = req.href
         try:
-            req.href = web.href.Href(tracwiki_base_path())
+            req.href = cached_href(tracwiki_base_path())
             return f(req, *args, **kwargs)
         finally:
             req.href = orig_href
@@ -123,17 +265,16 @@ class DjangoEnvironment(test.EnvironmentStub):
     """A Django environment for Trac."""
     
     def __init__(self):
+        # Environment is shared between concurrent renders so hrefs are stored per thread
+        self._hrefs = threading.local()
+        self._lazy_components_loaded = False
+
         components = list(COMPONENTS)
         components.extend(getattr(settings, 'CMS_MARKUP_TRAC_COMPONENTS', []))
 
-        super(DjangoEnvironment, self).__init__(enable=components)
+        super(DjangoEnvironment, self).__init__(enable=components + LAZY_COMPONENTS)
         
-        for c in components:
-            module_and_class = c.rsplit('.', 1)
-            if len(module_and_class) == 1:
-                __import__(name=module_and_class[0])
-            else:
-                __import__(name=module_and_class[0], fromlist=[module_and_class[1]])
+        self._import_components(components)
 
         self.config.set('trac', 'default_charset', 'utf-8')
         self.config.set('trac', 'never_obfuscate_mailto', True)
@@ -158,32 +299,115 @@ class DjangoEnvironment(test.EnvironmentStub):
 
         # TODO: Sync activated locales with Django?
 
-    def _set_abs_href(self, request):
-        site = sites_models.Site.objects.get_current() if sites_models.Site._meta.installed else sites_models.RequestSite(request)
+    def _import_components(self, components):
+        for c in components:
+            module_and_class = c.rsplit('.', 1)
+            if len(module_and_class) == 1:
+                __import__(name=module_and_class[0])
+            else:
+                __import__(name=module_and_class[0], fromlist=[module_and_class[1]])
+
+    def load_lazy_components(self):
+        if not self._lazy_components_loaded:
+            self._import_components(LAZY_COMPONENTS)
+            highlighting.patch_pygments_renderer()
+            self._lazy_components_loaded = True
+
+    def component_activated(self, component):
+        super(DjangoEnvironment, self).component_activated(component)
+        # Renderers are extensions of Mimeview so they have to be loaded before it is used
+        if isinstance(component, mimeview.Mimeview):
+            self.load_lazy_components()
 
+    def _get_thread_href(self):
+        return getattr(self._hrefs, 'href', None)
+
+    def _set_thread_href(self, href):
+        self._hrefs.href = href
+
+    href = property(_get_thread_href, _set_thread_href)
+
+    def _get_thread_abs_href(self):
+        return getattr(self._hrefs, 'abs_href', None)
+
+    def _set_thread_abs_href(self, abs_href):
+        self._hrefs.abs_href = abs_href
+
+    abs_href = property(_get_thread_abs_href, _set_thread_abs_href)
+
+    def _set_abs_href(self, request):
         server_port = str(request.META.get('SERVER_PORT', '80'))
-        if request.is_secure():
-            self.abs_href = web.href.Href('https://' + site.domain + (':' + server_port if server_port != '443' else '') + self.href())
+        if sites_models.Site._meta.installed:
+            site_key = ('site', settings.SITE_ID)
         else:
-            self.abs_href = web.href.Href('http://' + site.domain + (':' + server_port if server_port != '80' else '') + self.href())
+            site_key = ('request', request.get_host())
+        key = (request.is_secure(), site_key, server_port, self.href())
+
+        abs_href = _href_cache.get(key)
+        if abs_href is None:
+            site = sites_models.Site.objects.get_current() if sites_models.Site._meta.installed else sites_models.RequestSite(request)
+
+            if request.is_secure():
+                abs_href = web.href.Href('https://' + site.domain + (':' + server_port if server_port != '443' else '') + self.href())
+            else:
+                abs_href = web.href.Href('http://' + site.domain + (':' + server_port if server_port != '80' else '') + self.href())
+
+            _href_cache.set(key, abs_href)
+
+        self.abs_href = abs_href
 
     def switch_to_django_root(self, request=None):
-        self.href = web.href.Href(urlresolvers.reverse('pages-root'))
+        self.href = cached_href(cached_reverse('pages-root'))
         if request:
             self._set_abs_href(request)
 
     def switch_to_trac_root(self, request=None):
-        self.href = web.href.Href(tracwiki_base_path())
+        self.href = cached_href(tracwiki_base_path())
         if request:
             self._set_abs_href(request)
 
     def get_templates_dir(self):
         return getattr(settings, 'CMS_MARKUP_TRAC_TEMPLATES_DIR', super(DjangoEnvironment, self).get_templates_dir())
 
+_environment = None
+_environment_lock = threading.Lock()
+
+def get_environment():
+    """
+    Returns a process-wide Django environment for Trac, creating it on first use.
+    """
+
+    global _environment
+    if _environment is None:
+        with _environment_lock:
+            if _environment is None:
+                _environment = DjangoEnvironment()
+    return _environment
+
+def get_htdocs_dirs(env):
+    """
+    Returns a list of (prefix, directory) pairs of all static files Trac components provide. Directories
+    are canonical paths. The list is memoized per environment (and its lazily loaded components).
+    """
+
+    loaded = getattr(env, '_lazy_components_loaded', False)
+    memo = getattr(env, '_htdocs_dirs', None)
+    if memo is None or memo[0] != loaded:
+        dirs = []
+        for provider in trac_chrome.Chrome(env).template_providers:
+            for (prefix, directory) in provider.get_htdocs_dirs() or []:
+                if directory:
+                    dirs.append((prefix, os.path.realpath(directory)))
+        memo = env._htdocs_dirs = (loaded, dirs)
+    return memo[1]
+
 class DjangoChrome(trac_chrome.Chrome):
     @property
     def htdocs_location(self):
-        return web.href.Href(tracwiki_base_path()).chrome('common')
+        location = getattr(settings, 'CMS_MARKUP_TRAC_HTDOCS_LOCATION', None)
+        if location:
+            return location
+        return cached_href(tracwiki_base_path()).chrome('common')
 
 class DjangoRequestDispatcher(main.RequestDispatcher):
     pass
@@ -205,6 +429,26 @@ class DjangoRequest(web.Request):
         else:
             self.django_placeholder = None
         self.django_response = None
+
+        # Objects rendered content depends on, for render cache invalidation
+        self.render_dependencies = set()
+        # Components can mark rendered content as request-specific
+        self.render_cacheable = True
+        # Prefetched and already resolved resources, `None` for those which do not exist
+        self.resource_table = {}
+        # Prefetched plugins embedded in the content
+        self.django_plugins = {}
+        # Timings and query counts, if instrumentation is enabled
+        self.render_stats = None
+        # Plugins being rendered in parallel, by their tokens in the output
+        self.plugin_renders = {}
+        # Request-dependent parts of the content, when compiling it
+        self.compile_holes = None
+        # Value of the cache version clock when rendering started
+        self.render_clock = None
+        # Plugin whose content is rendered and its links in the link index
+        self.render_source = None
+        self.render_links = frozenset()
         
         self.perm = main.FakePerm()
         self.session = main.FakeSession()
@@ -277,12 +521,115 @@ class DjangoInterWikiMap(interwiki.InterWikiMap):
                 map[ns.upper()] = (ns, url, title)
         return map
 
+def _unique_anchor(base, anchors):
+    # Like Trac makes anchors unique
+    anchor = base
+    i = 1
+    while anchor in anchors:
+        anchor = base + str(i)
+        i += 1
+    return anchor
+
+def _rename_anchors(html, headings, anchors):
+    """
+    Makes anchors of headings in output formatted on its own unique among anchors already defined by
+    preceding output, adding them to `anchors`.
+    """
+
+    renames = {}
+    for (base, local) in headings:
+        anchor = _unique_anchor(base, anchors)
+        anchors[anchor] = True
+        if anchor != local:
+            renames[local] = anchor
+    if not renames:
+        return html
+    return HEADING_ID_RE.sub(lambda match: u'<h%s id="%s">' % (match.group(1), renames.get(match.group(2), match.group(2))), html)
+
+def split_blocks(text):
+    """
+    Splits wiki text into top-level blocks, at empty lines outside of code blocks. At those lines
+    formatter closes all open elements so blocks can be formatted one after another.
+    """
+
+    block = []
+    depth = 0
+    for line in text.splitlines():
+        if wiki.parser.WikiParser.ENDBLOCK not in line and wiki.parser.WikiParser._startblock_re.match(line):
+            depth += 1
+        elif depth and line.strip() == wiki.parser.WikiParser.ENDBLOCK:
+            depth -= 1
+        block.append(line)
+        if depth == 0 and line == '':
+            yield u'\n'.join(block)
+            block = []
+    if block:
+        yield u'\n'.join(block)
+
 class DjangoFormatter(wiki.formatter.Formatter):
+    # Whole text when formatting it block by block
+    document_source = None
+    # A list to record (base, anchor) pairs of headings into
+    heading_anchors = None
+
+    def reset(self, source, out=None):
+        source = super(DjangoFormatter, self).reset(source, out)
+        if self.document_source is not None:
+            # Macros like PageOutline work on the whole text
+            self.source = self.document_source
+        return source
+
+    def format_blocks(self, text):
+        """
+        Formats text block by block, yielding output of each block.
+        """
+
+        self.document_source = text
+        for block in split_blocks(text):
+            out = StringIO()
+            self.format(block, out)
+            yield out.getvalue()
+
     def _parse_heading(self, match, fullmatch, shorten):
-        (depth, heading, anchor) = super(DjangoFormatter, self)._parse_heading(match, fullmatch, shorten)
+        # Anchor is made unique here, so that its base is known
+        anchors = self._anchors
+        self._anchors = {}
+        try:
+            (depth, heading, base) = super(DjangoFormatter, self)._parse_heading(match, fullmatch, shorten)
+        finally:
+            self._anchors = anchors
+        anchor = _unique_anchor(base, anchors)
+        anchors[anchor] = True
+        if self.heading_anchors is not None:
+            self.heading_anchors.append((base, anchor))
         depth = min(depth + getattr(settings, 'CMS_MARKUP_TRAC_HEADING_OFFSET', 1), 6)
         return (depth, heading, anchor)
     
+    def _macro_formatter(self, match, fullmatch, macro=None):
+        name = fullmatch.group('macroname')
+        compiling = getattr(self.req, 'compile_holes', None) is not None
+        if macro and name not in STATIC_MACROS and compiling:
+            return _add_hole(self.req, ('macro', fullmatch.string))
+        with instrumentation.measure(getattr(self.req, 'render_stats', None), name, 'macros'):
+            result = super(DjangoFormatter, self)._macro_formatter(match, fullmatch, macro)
+        if compiling and result:
+            # Holes in copied text (like headings in PageOutline) are left as they are, without links
+            result = genshi_core.Markup(HOLE_MARKER_RE.sub('', wiki.formatter._markup_to_unicode(result)))
+        return result
+
+    def expand_macro_text(self, text):
+        """
+        Expands a macro given as its text inside `[[` and `]]`.
+        """
+
+        fullmatch = wiki.parser.WikiParser._macro_re.match(text)
+        name = fullmatch.group('macroname')
+        if name[-1] == '?':
+            macro = wiki.formatter.WikiProcessor(self, 'MacroList')
+        else:
+            macro = wiki.formatter.WikiProcessor(self, name)
+        return self._macro_formatter(None, fullmatch, macro)
+
     def _make_lhref_link(self, match, fullmatch, rel, ns, target, label):
         # We override _make_lhref_link to make 'cms' namespace default and Django root
         with django_root(self):
@@ -299,23 +646,84 @@ class DjangoFormatter(wiki.formatter.Formatter):
             return self._make_ext_link(url, label, title)
 
 class DjangoResource(resource.Resource):
-    __slots__ = ('django_request', 'django_context')
+    __slots__ = ('django_request', 'django_context', 'trac_request')
+
+class LinkResolution(object):
+    """
+    Per-resolution state for links resolved without a formatter, in place of `DjangoRequest`.
+    """
+
+    def __init__(self):
+        self.render_dependencies = set()
+        self.render_cacheable = True
+        self.resource_table = {}
+        self.render_stats = None
+        self.render_source = None
+        self.render_links = frozenset()
 
 class DjangoComponent(Component):
     implements(resource.IResourceManager, wiki.IWikiSyntaxProvider)
     
     def _format_link(self, formatter, ns, target, label, fullmatch=None):
+        if getattr(formatter.req, 'compile_holes', None) is not None:
+            return _add_hole(formatter.req, ('link', ns, target, unicode(label), formatter.href.base), label)
+        with instrumentation.measure(getattr(formatter.req, 'render_stats', None), ns, 'links'):
+            return self._make_link(formatter, ns, target, label)
+
+    def _make_link(self, formatter, ns, target, label):
         link, params, fragment = formatter.split_link(target)
         res = DjangoResource(ns, link)
         res.django_request = _get_django_request(req=formatter.req)
         res.django_context = _get_django_context(req=formatter.req)
+        res.trac_request = formatter.req
         try:
             href = resource.get_resource_url(self.env, res, formatter.href)
             title = resource.get_resource_name(self.env, res)
             return tag.a(label, title=title, href=href + params + fragment)
         except resource.ResourceNotFound:
+            # Any new object in the realm could resolve the link
+            _add_dependency(ns, None, res=res)
             return tag.a(label + '?', class_='missing', href=target, rel='nofollow')
     
+    def resolve_link(self, request, context, value):
+        """
+        Resolves a TracLink to a Django resource into an URL, without a formatter. Results are memoized
+        per target, language and URL root for `CMS_MARKUP_TRAC_LINK_CACHE_TIMEOUT` seconds.
+
+        Returns `None` if the link cannot be resolved this way (it is not a plain link to a Django resource)
+        and raises `ResourceNotFound` if the resource does not exist.
+        """
+
+        if not value or value[0] in './#' or re.search(r'[\s"\']', value):
+            return None
+
+        ns, sep, target = value.partition(':')
+        if not sep:
+            # Default namespace, like with DjangoFormatter
+            ns, target = 'cms', value
+        elif ns not in self.get_resource_realms():
+            return None
+
+        link, query, fragment = wiki.formatter.split_url_into_path_query_fragment(target)
+
+        key = (value, django_translation.get_language(), urlresolvers.get_urlconf(), urlresolvers.get_script_prefix(), request.user.is_staff)
+        cached = _link_cache.get(key)
+        if cached is not None and time.time() - cached[1] < getattr(settings, 'CMS_MARKUP_TRAC_LINK_CACHE_TIMEOUT', 60):
+            return cached[0]
+
+        state = LinkResolution()
+        res = DjangoResource(ns, link)
+        res.django_request = request
+        res.django_context = context
+        res.trac_request = state
+        href = self.get_resource_url(res, cached_href(cached_reverse('pages-root'))) + query + fragment
+
+        # Links to current page or user-dependent resources are not memoized
+        if link and state.render_cacheable:
+            _link_cache.set(key, (href, time.time()))
+
+        return href
+
     # IResourceManager methods
     
     def get_resource_realms(self):
@@ -347,8 +755,9 @@ class DjangoComponent(Component):
                 if not res.id:
                     raise resource.ResourceNotFound(e)
 
+                _add_dependency('cms', None, res=res)
                 try:
-                    link = urlresolvers.reverse(res.id)
+                    link = cached_reverse(res.id)
                 except urlresolvers.NoReverseMatch as e:
                     raise resource.ResourceNotFound(e)
         else:
@@ -410,14 +819,61 @@ class DjangoComponent(Component):
                 return False
             
             try:
-                urlresolvers.reverse(res.id)
+                cached_reverse(res.id)
                 return True
             except urlresolvers.NoReverseMatch:
                 return False
         else:
             raise RuntimeError("This should be impossible")
 
+    def _lookup(self, realm, res, ctx, find, does_not_exist):
+        """
+        Finds a resource using `find` only once per render, memoizing the result (or that it does not exist)
+        in the per-render resource table, keyed by realm, ID and language.
+        """
+
+        req = _get_trac_request(res=res, ctx=ctx)
+        key = _resource_key(realm, res.id)
+        if req is not None and key in req.resource_table:
+            obj = req.resource_table[key]
+        else:
+            try:
+                obj = find(res, ctx)
+            except does_not_exist:
+                obj = None
+            if req is not None:
+                req.resource_table[key] = obj
+
+        if obj is None:
+            raise does_not_exist()
+        _add_dependency(realm, obj.pk, res=res, ctx=ctx)
+        return obj
+
     def _get_page(self, res, ctx=None):
+        return self._lookup('cms', res, ctx, self._find_page, cms_models.Page.DoesNotExist)
+
+    def _get_file(self, res, ctx=None):
+        f = self._lookup('filer', res, ctx, self._find_file, filer_models.File.DoesNotExist)
+        if f.is_public:
+            return f
+        # Permission check depends on the user so rendered content cannot be shared
+        _set_uncacheable(res=res, ctx=ctx)
+        request = _get_django_request(res=res, ctx=ctx)
+        # Permission checks are memoized for the request (and so its user)
+        permissions = getattr(request, '_tracwiki_file_permissions', None)
+        if permissions is None:
+            permissions = request._tracwiki_file_permissions = {}
+        if f.pk not in permissions:
+            permissions[f.pk] = f.has_read_permission(request)
+        if permissions[f.pk]:
+            return f
+        else:
+            raise filer_models.File.DoesNotExist()
+
+    def _get_blog(self, res, ctx=None):
+        return self._lookup('blog', res, ctx, self._find_blog, blog_models.EntryTitle.DoesNotExist)
+
+    def _find_page(self, res, ctx=None):
         page_id = res.id
         request = _get_django_request(res=res, ctx=ctx)
         if not page_id: # links like [cms: current page]
@@ -443,21 +899,21 @@ class DjangoComponent(Component):
         else:
             return moderator.get_page_queryset(request).get(reverse_id=page_id)
 
-    def _get_file(self, res, ctx=None):
+    def _find_file(self, res, ctx=None):
         file_id = res.id
         if not file_id:
             raise filer_models.File.DoesNotExist()
-        request = _get_django_request(res=res, ctx=ctx)
-        try:
-            f = filer_models.File.objects.get(Q(original_filename=file_id) | Q(name=file_id) | Q(sha1=file_id) | Q(file=file_id))
-        except filer_models.File.MultipleObjectsReturned as e:
-            raise filer_models.File.DoesNotExist(e)
-        if f.is_public or f.has_read_permission(request):
-            return f
-        else:
-            raise filer_models.File.DoesNotExist()
-
-    def _get_blog(self, res, ctx=None):
+        # Each field separately, so that its index can be used
+        for field in self._file_lookup_fields(file_id):
+            files = list(filer_models.File.objects.filter(**{field: file_id})[:2])
+            if len(files) == 1:
+                return files[0]
+            elif files:
+                # Ambiguous
+                raise filer_models.File.DoesNotExist()
+        raise filer_models.File.DoesNotExist()
+
+    def _find_blog(self, res, ctx=None):
         blog_id = res.id
 
         if not blog_id: # links like [blog: current blog entry]
@@ -468,33 +924,143 @@ class DjangoComponent(Component):
             if not plugin:
                 raise blog_models.EntryTitle.DoesNotExist()
 
-            try:
-                return plugin.placeholder.entry_set.get().entrytitle_set.get()
-            except (blog_models.Entry.DoesNotExist, blog_models.Entry.MultipleObjectsReturned) as e:
-                # MultipleObjectsReturned should not happen
-                raise blog_models.EntryTitle.DoesNotExist(e)
-            except blog_models.EntryTitle.MultipleObjectsReturned as e:
-                # Should not happen
-                raise blog_models.EntryTitle.DoesNotExist(e)
+            # Entry is used for its URL
+            entries = list(blog_models.EntryTitle.objects.select_related('entry').filter(entry__placeholders=plugin.placeholder_id))
+            if len(entries) > 1:
+                lang = django_translation.get_language()
+                entries = [e for e in entries if e.language == lang]
+            if len(entries) != 1:
+                raise blog_models.EntryTitle.DoesNotExist()
+            return entries[0]
 
         else:
             ids = blog_id.split(":", 1)
 
             if len(ids) == 1:
-                blog_id = ids[0]
+                entries = blog_models.EntryTitle.objects.select_related('entry').filter(slug=ids[0])
+            else:
+                entries = blog_models.EntryTitle.objects.select_related('entry').filter(slug=ids[1], language=ids[0])
 
-                entries = blog_models.EntryTitle.objects.filter(slug=blog_id)
-                if len(entries) == 0:
-                    raise blog_models.EntryTitle.DoesNotExist
-                elif len(entries) == 1:
-                    return entries[0]
-                else:
-                    lang = django_translation.get_language()
-                    return entries.get(language=lang)
+            return self._select_blog(blog_id, entries)
 
-            else:
-                (lang, blog_id) = ids
-                return blog_models.EntryTitle.objects.get(slug=blog_id, language=lang)
+    def _file_lookup_fields(self, file_id):
+        if SHA1_RE.match(file_id):
+            return ('sha1',) + FILE_LOOKUP_FIELDS
+        return FILE_LOOKUP_FIELDS
+
+    def _file_field_value(self, f, field):
+        if field == 'file':
+            return f.file.name
+        return getattr(f, field)
+
+    def _select_blog(self, blog_id, entries):
+        ids = blog_id.split(":", 1)
+
+        if len(ids) == 1:
+            entries = [e for e in entries if e.slug == ids[0]]
+            if len(entries) > 1:
+                lang = django_translation.get_language()
+                entries = [e for e in entries if e.language == lang]
+        else:
+            (lang, slug) = ids
+            entries = [e for e in entries if e.slug == slug and e.language == lang]
+
+        if len(entries) != 1:
+            raise blog_models.EntryTitle.DoesNotExist()
+        return entries[0]
+
+    def find_resource_links(self, text):
+        """
+        Returns a map from realms to sets of IDs of (a superset of) links to Django resources found in the text.
+        """
+
+        realms = set(ns for (ns, resolver) in self.get_link_resolvers())
+        ids = {}
+        for match in RESOURCE_LINK_RE.finditer(text):
+            for (ns, tgt) in (('cns', 'ctgt'), ('lns', 'ltgt'), ('sns', 'stgt')):
+                if match.group(ns):
+                    realm = match.group(ns)
+                    target = match.group(tgt).strip()
+                    break
+            if realm not in realms:
+                continue
+            if len(target) > 1 and target[0] in '"\'' and target[0] == target[-1]:
+                target = target[1:-1]
+            link = wiki.formatter.split_url_into_path_query_fragment(target)[0]
+            if link:
+                ids.setdefault(realm, set()).add(link)
+        return ids
+
+    def prefetch_resources(self, req, text):
+        """
+        Resolves all links to Django resources found in the text with one query per realm and stores
+        them into the per-render resource table.
+        """
+
+        ids = self.find_resource_links(text)
+        request = req.django_request
+
+        if ids.get('cms'):
+            with instrumentation.measure(req.render_stats, 'cms', 'links'):
+                self._prefetch_pages(req, request, ids['cms'])
+
+        if USING_FILER and ids.get('filer'):
+            with instrumentation.measure(req.render_stats, 'filer', 'links'):
+                self._prefetch_files(req, ids['filer'])
+
+        if ids.get('blog'):
+            with instrumentation.measure(req.render_stats, 'blog', 'links'):
+                self._prefetch_blogs(req, ids['blog'])
+
+    def _prefetch_pages(self, req, request, page_ids):
+        pages = {}
+        for page in moderator.get_page_queryset(request).filter(reverse_id__in=page_ids):
+            pages.setdefault(page.reverse_id, []).append(page)
+
+        lang = cms_utils.get_language_from_request(request)
+        titles = {}
+        for title in cms_models.Title.objects.filter(page__in=[p[0] for p in pages.itervalues()], language=lang):
+            titles[title.page_id] = title
+
+        for page_id in page_ids:
+            if page_id not in pages:
+                req.resource_table[_resource_key('cms', page_id)] = None
+            elif len(pages[page_id]) == 1:
+                page = pages[page_id][0]
+                # We populate page's title cache
+                if page.pk in titles:
+                    page.title_cache = {lang: titles[page.pk]}
+                req.resource_table[_resource_key('cms', page_id)] = page
+
+    def _prefetch_files(self, req, file_ids):
+        # Fields in the same order as in _find_file, with one query per field
+        unresolved = set(file_ids)
+        for field in ('sha1',) + FILE_LOOKUP_FIELDS:
+            ids = [file_id for file_id in unresolved if field in self._file_lookup_fields(file_id)]
+            if not ids:
+                continue
+
+            files = {}
+            for f in filer_models.File.objects.filter(**{'%s__in' % field: ids}):
+                files.setdefault(self._file_field_value(f, field), []).append(f)
+
+            for file_id in ids:
+                if file_id in files:
+                    # Ambiguous if more than one
+                    req.resource_table[_resource_key('filer', file_id)] = files[file_id][0] if len(files[file_id]) == 1 else None
+                    unresolved.discard(file_id)
+
+        for file_id in unresolved:
+            req.resource_table[_resource_key('filer', file_id)] = None
+
+    def _prefetch_blogs(self, req, blog_ids):
+        slugs = set(blog_id.split(":", 1)[-1] for blog_id in blog_ids)
+        entries = list(blog_models.EntryTitle.objects.select_related('entry').filter(slug__in=slugs))
+        for blog_id in blog_ids:
+            try:
+                req.resource_table[_resource_key('blog', blog_id)] = self._select_blog(blog_id, entries)
+            except blog_models.EntryTitle.DoesNotExist:
+                req.resource_table[_resource_key('blog', blog_id)] = None
 
     def _get_plugin(self, request, context):
         if context and context.get('object'):
@@ -531,12 +1097,22 @@ class Markup(markup_plugins.MarkupBase):
     _formatter = DjangoFormatter
 
     def __init__(self, *args, **kwargs):
-        self.env = DjangoEnvironment()
-        self.scripts = []
-        self.links = {}
+        if getattr(settings, 'CMS_MARKUP_TRAC_BLOCK_CACHE', False) and getattr(settings, 'CMS_MARKUP_TRAC_COMPILE', False):
+            raise django_exceptions.ImproperlyConfigured(
+                "CMS_MARKUP_TRAC_BLOCK_CACHE and CMS_MARKUP_TRAC_COMPILE settings cannot be enabled together."
+            )
+        self.env = get_environment()
+        # Scripts and links of the last render in the current thread
+        self._assets = threading.local()
 
     def _prepare_environment(self, context=None, placeholder=None):
         request = _get_django_request(context=context)
+        if request is None:
+            raise django_exceptions.ImproperlyConfigured(
+                "Rendering Trac wiki content requires the current request. Add "
+                "'cmsplugin_markup_tracwiki.middleware.CurrentRequestMiddleware' to MIDDLEWARE_CLASSES, "
+                "or enable CMS_MARKUP_TRAC_FRAME_FALLBACK setting."
+            )
         self.env.switch_to_trac_root(request)
         if not context:
             context = template.RequestContext(request, {})
@@ -547,34 +1123,446 @@ class Markup(markup_plugins.MarkupBase):
         return ctx, req
 
     def parse(self, value, context=None, placeholder=None):
-        ctx, req = self._prepare_environment(context, placeholder)
+        request = _get_django_request(context=context)
+        with django_request_context(request, context):
+            return self._parse(value, context, placeholder)
+
+    def _parse(self, value, context=None, placeholder=None):
+        self._reset_scripts_and_links()
+        stats = instrumentation.new_stats()
+
+        key = self._get_cache_key(value, context) if caching.is_enabled() else None
+        if key:
+            with instrumentation.measure(stats, 'cache'):
+                entry = caching.get_rendered(key)
+            if entry is not None:
+                self._add_scripts_and_links(entry['scripts'], entry['links'])
+                if stats:
+                    stats.cached = True
+                    stats.size = len(entry['html'])
+                    instrumentation.record(stats)
+                return entry['html']
+
+        ctx, req = self._prepare_render(value, context, placeholder, stats)
         out = StringIO()
-        self._formatter(self.env, ctx).format(value, out)
-        self._all_scripts_and_links(req)
-        return out.getvalue()
+        with instrumentation.measure(stats, 'format'):
+            if caching.is_enabled() and getattr(settings, 'CMS_MARKUP_TRAC_BLOCK_CACHE', False):
+                self._format_with_block_cache(ctx, req, value, out)
+            elif getattr(settings, 'CMS_MARKUP_TRAC_COMPILE', False):
+                self._fill(ctx, req, self._get_compiled(value, context), out)
+            else:
+                self._formatter(self.env, ctx).format(value, out)
+        output = parallel.splice(req, out.getvalue())
+        scripts, links = self._new_scripts_and_links(req)
+        self._add_scripts_and_links(scripts, links)
+
+        if key and req.render_cacheable:
+            caching.set_rendered(key, output, scripts, links, req.render_dependencies, req.render_clock)
+
+        if stats:
+            stats.size = len(output)
+            instrumentation.record(stats)
+
+        return output
+
+    def compile(self, value, context=None, plugin_id=None):
+        """
+        Compiles text into static HTML segments and holes for request-dependent parts (links to Django
+        resources and macros), which are filled when rendering. Compiled text is stored into the database
+        (for the plugin with `plugin_id`, if given) and the cache backend, and returned.
+        """
+
+        from cmsplugin_markup_tracwiki import models as tracwiki_models
+
+        request = _get_django_request(context=context)
+        with django_request_context(request, context):
+            ctx, req = self._prepare_environment(context)
+            req.compile_holes = []
+            out = StringIO()
+            self._formatter(self.env, ctx).format(value, out)
+            scripts, links = self._new_scripts_and_links(req)
+
+            segments = HOLE_RE.split(out.getvalue())
+            holes = {}
+            for i in range(1, len(segments), 2):
+                segments[i] = int(segments[i])
+                holes[segments[i]] = req.compile_holes[segments[i]]
+
+            compiled = {
+                'segments': [segment for segment in segments if segment != u''],
+                'holes': holes,
+                'scripts': scripts,
+                'links': links,
+            }
+            key = self._get_compiled_key(value)
+            tracwiki_models.store_compiled(key, compiled, plugin_id)
+            caching.get_cache().set(key, compiled, caching.get_timeout())
+            return compiled
+
+    def _get_compiled_key(self, value):
+        return caching.make_key('compiled',
+            COMPILED_VERSION,
+            value,
+            django_translation.get_language(),
+            tracwiki_base_path(),
+            cached_reverse('pages-root'),
+            getattr(settings, 'CMS_MARKUP_TRAC_HEADING_OFFSET', 1),
+        )
+
+    def _get_compiled(self, value, context=None):
+        from cmsplugin_markup_tracwiki import models as tracwiki_models
+
+        key = self._get_compiled_key(value)
+        # Cache backend is only in front of the database
+        compiled = caching.get_cache().get(key)
+        if compiled is None:
+            compiled = tracwiki_models.load_compiled(key)
+            if compiled is not None:
+                caching.get_cache().set(key, compiled, caching.get_timeout())
+        if compiled is None:
+            plugin = context.get('object') if context else None
+            plugin_id = plugin.pk if getattr(plugin, 'body', None) == value else None
+            compiled = self.compile(value, context, plugin_id)
+        return compiled
+
+    def _fill(self, ctx, req, compiled, out):
+        """
+        Renders compiled text by filling its holes.
+        """
+
+        self._restore_scripts_and_links(req, compiled['scripts'], compiled['links'])
+        formatter = self._formatter(self.env, ctx)
+        for segment in compiled['segments']:
+            if not isinstance(segment, int):
+                out.write(segment)
+                continue
+
+            hole = compiled['holes'][segment]
+            if hole[0] == 'link':
+                (kind, ns, target, label, base) = hole
+                href = formatter.href
+                try:
+                    formatter.href = cached_href(base)
+                    result = DjangoComponent(self.env)._format_link(formatter, ns, target, genshi_core.Markup(label))
+                finally:
+                    formatter.href = href
+            else:
+                result = formatter.expand_macro_text(hole[1])
+            if result:
+                out.write(wiki.formatter._markup_to_unicode(result))
+
+    def _format_with_block_cache(self, ctx, req, value, out):
+        """
+        Formats text block by block, reusing cached output of blocks which have not changed. Each block
+        is formatted (and cached) as if it was on its own, together with heading anchors it defines, which
+        are then made unique among anchors of preceding blocks, as when formatting the whole text at once.
+        """
+
+        formatter = self._formatter(self.env, ctx)
+        formatter.document_source = value
+        key_parts = self._cache_key_parts(req.django_request, req.django_context, self.is_text_dynamic(value))
+        anchors = {}
+
+        for block in split_blocks(value):
+            key = caching.make_key('block',
+                block,
+                value if DOCUMENT_MACRO_RE.search(block) else None,
+                *key_parts
+            )
+            entry = caching.get_rendered(key)
+            if entry is not None:
+                out.write(_rename_anchors(entry['html'], entry['headings'], anchors))
+                self._restore_scripts_and_links(req, entry['scripts'], entry['links'])
+                req.render_dependencies.update(entry['dependencies'])
+                continue
+
+            formatter._anchors = {}
+            formatter.heading_anchors = []
+            html, scripts, links, block_dependencies, block_cacheable = self._format_separately(formatter, req, block)
+            out.write(_rename_anchors(html, formatter.heading_anchors, anchors))
+
+            if block_cacheable:
+                caching.set_rendered(key, html, scripts, links, block_dependencies, req.render_clock,
+                    headings=formatter.heading_anchors,
+                    dependencies=list(block_dependencies),
+                )
+
+    def _format_separately(self, formatter, req, text):
+        """
+        Formats text with a request shared with other texts, returning a tuple of its output, scripts and
+        links it uses, objects it depends on and whether it can be cached. Those are also added to the request.
+        """
+
+        dependencies = req.render_dependencies
+        cacheable = req.render_cacheable
+        chrome = dict((k, req.chrome[k]) for k in ('scripts', 'scriptset', 'links', 'linkset') if k in req.chrome)
+
+        # Scripts and links already used by other texts have to be added again
+        for k in chrome:
+            del req.chrome[k]
+        req.render_dependencies = set()
+        if req.render_source is not None:
+            req.render_dependencies.add(('source', req.render_source))
+        req.render_cacheable = True
+
+        try:
+            out = StringIO()
+            formatter.format(text, out)
+            output = parallel.splice(req, out.getvalue())
+            scripts, links = self._new_scripts_and_links(req)
+            text_dependencies = req.render_dependencies
+            text_cacheable = req.render_cacheable
+        finally:
+            for k in ('scripts', 'scriptset', 'links', 'linkset'):
+                req.chrome.pop(k, None)
+            req.chrome.update(chrome)
+            dependencies.update(req.render_dependencies)
+            req.render_dependencies = dependencies
+            req.render_cacheable = cacheable and req.render_cacheable
+
+        self._restore_scripts_and_links(req, scripts, links)
+        return (output, scripts, links, text_dependencies, text_cacheable)
+
+    def _prepare_render(self, value, context=None, placeholder=None, stats=None):
+        with instrumentation.measure(stats, 'prepare'):
+            ctx, req = self._prepare_environment(context, placeholder)
+        req.render_stats = stats
+        if caching.is_enabled():
+            # Read before any object is loaded, so that changes while rendering are noticed
+            req.render_clock = caching.get_clock()
+
+        plugin = context.get('object') if context else None
+        if getattr(settings, 'CMS_MARKUP_TRAC_LINK_INDEX', False) and getattr(plugin, 'body', None) == value:
+            # Content is invalidated through the link index when objects its links could resolve to appear
+            req.render_source = plugin.pk
+            req.render_links = self.link_targets(value)
+            req.render_dependencies.add(('source', plugin.pk))
+
+        with instrumentation.measure(stats, 'prefetch'):
+            DjangoComponent(self.env).prefetch_resources(req, value)
+            req.django_plugins = get_plugins(self.plugin_id_list(value))
+        return ctx, req
+
+    def parse_iter(self, value, context=None, placeholder=None):
+        """
+        Parses like `parse`, but yields output in chunks, block by block, as it is being produced, so that
+        it can be streamed. Scripts and stylesheets are available once all output has been consumed.
+        Output is not cached.
+        """
+
+        request = _get_django_request(context=context)
+        stats = instrumentation.new_stats()
+        with django_request_context(request, context):
+            self._reset_scripts_and_links()
+            ctx, req = self._prepare_render(value, context, placeholder, stats)
+            blocks = self._formatter(self.env, ctx).format_blocks(value)
+
+        while True:
+            # Generator can be resumed from other code so we have to set request and context every time
+            with django_request_context(request, context):
+                try:
+                    with instrumentation.measure(stats, 'format'):
+                        chunk = parallel.splice(req, blocks.next())
+                except StopIteration:
+                    break
+            if stats:
+                stats.size += len(chunk)
+            yield chunk
+
+        self._add_scripts_and_links(*self._new_scripts_and_links(req))
+        instrumentation.record(stats)
+
+    def parse_many(self, values, context=None, placeholder=None):
+        """
+        Parses multiple texts (like of all plugins on a placeholder) sharing the environment, request and
+        context among them, and resolving their links and embedded plugins together. Returns a tuple of
+        a list of outputs and lists of scripts and stylesheets used by all of them.
+        """
+
+        request = _get_django_request(context=context)
+        with django_request_context(request, context):
+            return self._parse_many(values, context, placeholder)
+
+    def _parse_many(self, values, context=None, placeholder=None):
+        self._reset_scripts_and_links()
+        stats = instrumentation.new_stats()
+
+        outputs = [None] * len(values)
+        keys = [self._get_cache_key(value, context) if caching.is_enabled() else None for value in values]
+        with instrumentation.measure(stats, 'cache'):
+            for (i, key) in enumerate(keys):
+                entry = caching.get_rendered(key) if key else None
+                if entry is not None:
+                    outputs[i] = entry['html']
+                    self._add_scripts_and_links(entry['scripts'], entry['links'])
+
+        pending = [i for (i, output) in enumerate(outputs) if output is None]
+        if pending:
+            ctx, req = self._prepare_render(u'\n'.join(values[i] for i in pending), context, placeholder, stats)
+            with instrumentation.measure(stats, 'format'):
+                for i in pending:
+                    # Each text is formatted on its own, as with parse
+                    html, scripts, links, dependencies, cacheable = self._format_separately(self._formatter(self.env, ctx), req, values[i])
+                    outputs[i] = html
+                    self._add_scripts_and_links(scripts, links)
+                    if keys[i] and cacheable:
+                        caching.set_rendered(keys[i], html, scripts, links, dependencies, req.render_clock)
+
+        if stats:
+            stats.cached = not pending
+            stats.size = sum(len(output) for output in outputs)
+            instrumentation.record(stats)
+
+        return (outputs, self.get_scripts(), self.get_stylesheets())
+
+    def _get_cache_key(self, value, context=None):
+        request = _get_django_request(context=context)
+        if request is None or request.method != 'GET':
+            # We do not cache previews and other POST requests
+            return None
+
+        return caching.make_key('render', value, *self._cache_key_parts(request, context, self.is_text_dynamic(value)))
+
+    def _cache_key_parts(self, request, context=None, dynamic=True):
+        parts = [
+            django_translation.get_language(),
+            request.is_secure(),
+            request.get_host(),
+            request.META.get('SERVER_PORT', ''),
+            tracwiki_base_path(),
+            cached_reverse('pages-root'),
+        ]
+        if not dynamic:
+            # Static content is shared between pages, plugins and users
+            return parts
+
+        current_page = getattr(request, 'current_page', None)
+        plugin = context.get('object') if context else None
+        plugin_edit = PLUGIN_EDIT_RE.search(request.path)
+        return parts + [
+            # Draft pages and permission-dependent resources can be visible to staff
+            request.user.is_staff,
+            # Edit mode and previews resolve links to draft pages
+            'edit' in request.GET,
+            'preview' in request.GET,
+            # For [cms:] and [blog:] links to current page and entry
+            getattr(current_page, 'pk', None),
+            getattr(plugin, 'pk', None),
+            # Hints for current page and plugin in previews
+            request.POST.get('page_id'),
+            request.POST.get('plugin_id'),
+            plugin_edit and plugin_edit.group(1),
+        ]
 
     def plugin_id_list(self, text):
         return OBJ_ADMIN_RE.findall(text)
 
+    def is_text_dynamic(self, text):
+        """
+        Returns if the text (possibly) contains constructs whose output depends on the request or on other
+        objects: links to Django resources (including links to the current page or entry and to files
+        with permissions), embedded plugins and macros (except those in `STATIC_MACROS`). Output of other
+        text depends only on the text, language and URL root.
+        """
+
+        dynamic = _dynamic_cache.get(text)
+        if dynamic is None:
+            dynamic = self._is_text_dynamic(text)
+            _dynamic_cache.set(text, dynamic)
+        return dynamic
+
+    def _is_text_dynamic(self, text):
+        if self.plugin_id_list(text) or RESOURCE_LINK_RE.search(text):
+            return True
+
+        for match in MACROLINK_RE.finditer(text):
+            content = match.group(1).strip()
+            target = content.split('|', 1)[0].strip()
+            # Relative links are relative to Django root and links with (other) schemes are external
+            if target[:1] in ('/', '.', '#') or LINK_SCHEME_RE.match(target):
+                continue
+            macro = wiki.parser.WikiParser._macro_re.match(content)
+            # Otherwise it is a macro or a link to a page in the default namespace
+            if not macro or macro.group('macroname').rstrip('?') not in STATIC_MACROS + ('', 'br'):
+                return True
+
+        macros = set()
+        for provider in wiki.api.WikiSystem(self.env).macro_providers:
+            macros.update(provider.get_macros() or [])
+        for match in PROCESSOR_RE.finditer(text):
+            name = match.group(1)
+            if name in macros and name not in STATIC_MACROS:
+                return True
+
+        return False
+
+    def link_targets(self, text):
+        """
+        Returns a set of (realm, target) pairs of Django resources and plugins the text links to.
+        """
+
+        targets = set()
+        for (realm, ids) in DjangoComponent(self.env).find_resource_links(text).iteritems():
+            # Longer targets cannot be stored in the link index
+            targets.update((realm, i) for i in ids if len(i) <= LINK_TARGET_MAX_LENGTH)
+        targets.update(('plugin', str(int(plugin_id))) for plugin_id in self.plugin_id_list(text))
+        return targets
+
     def _early_scripts_and_links(self, req):
-        self._early_scripts_hrefs = [s['href'] for s in req.chrome.get('scripts', [])]
-        self._early_links_ids = ['%s:%s' % (r, l['href']) for (r, ls) in req.chrome.get('links', {}).iteritems() for l in ls]
+        req.early_scripts_hrefs = [s['href'] for s in req.chrome.get('scripts', [])]
+        req.early_links_ids = ['%s:%s' % (r, l['href']) for (r, ls) in req.chrome.get('links', {}).iteritems() for l in ls]
 
-    def _all_scripts_and_links(self, req):
+    def _new_scripts_and_links(self, req):
+        scripts = []
         for script in req.chrome.get('scripts', []):
-            if script['href'] not in self._early_scripts_hrefs:
-                self.scripts.append({'href': script['href'], 'type': script.get('type', "text/javascript")})
+            if script['href'] not in req.early_scripts_hrefs:
+                scripts.append({'href': script['href'], 'type': script.get('type', "text/javascript")})
+
+        links = {}
+        for (rel, ls) in req.chrome.get('links', {}).iteritems():
+            for l in ls:
+                if '%s:%s' % (rel, l['href']) not in req.early_links_ids:
+                    links.setdefault(rel, []).append(l)
+
+        return scripts, links
+
+    def _restore_scripts_and_links(self, req, scripts, links):
+        hrefs = set(s['href'] for s in req.chrome.get('scripts', []))
+        for script in scripts:
+            if script['href'] not in hrefs:
+                req.chrome.setdefault('scripts', []).append(script)
+                hrefs.add(script['href'])
+        for (rel, ls) in links.iteritems():
+            for l in ls:
+                attrs = dict((str(k), v) for (k, v) in l.iteritems() if k not in ('href', 'title', 'type', 'class'))
+                trac_chrome.add_link(req, rel, l['href'], l.get('title'), l.get('type'), l.get('class'), **attrs)
+
+    def _reset_scripts_and_links(self):
+        # Ordered and deduplicated by href
+        self._assets.scripts = datastructures.SortedDict()
+        self._assets.links = {}
+
+    def _add_scripts_and_links(self, scripts, links):
+        for script in scripts:
+            self._assets.scripts.setdefault(script['href'], script)
+        for (rel, ls) in links.iteritems():
+            rel_links = self._assets.links.setdefault(rel, datastructures.SortedDict())
+            for l in ls:
+                rel_links.setdefault(l['href'], l)
+
+    def parse_with_assets(self, value, context=None, placeholder=None):
+        """
+        Returns a tuple of parsed output and lists of scripts and stylesheets used by it.
+        """
 
-        for (rel, links) in req.chrome.get('links', {}).iteritems():
-            for l in links:
-                if '%s:%s' % (rel, l['href']) not in self._early_links_ids:
-                    self.links.setdefault(rel, []).append(l)
+        output = self.parse(value, context, placeholder)
+        return (output, self.get_scripts(), self.get_stylesheets())
 
     def get_scripts(self):
-        return self.scripts
+        return getattr(self._assets, 'scripts', {}).values()
 
     def get_stylesheets(self):
-        return [{'href': s['href'], 'type': s.get('type', "text/css")} for s in self.links.get('stylesheet', [])]
+        return [{'href': s['href'], 'type': s.get('type', "text/css")} for s in getattr(self._assets, 'links', {}).get('stylesheet', {}).values()]
 
     def get_plugin_urls(self):
         from django.conf.urls.defaults import patterns, url
@@ -587,7 +1575,26 @@ class Markup(markup_plugins.MarkupBase):
 
         return trac_urls + urls
 
+    def _find_chrome_file(self, prefix, filename):
+        for (dir_prefix, directory) in get_htdocs_dirs(self.env):
+            if dir_prefix != prefix:
+                continue
+            path = os.path.realpath(os.path.join(directory, filename))
+            if not path.startswith(directory + os.sep):
+                # Outside of the directory (directories are already canonical)
+                return None
+            if os.path.isfile(path):
+                return path
+        return None
+
     def serve_trac_path(self, request, path):
+        # Static files are served directly, without Trac request dispatching
+        match = CHROME_PATH_RE.match(path)
+        if match and request.method in ('GET', 'HEAD'):
+            filename = self._find_chrome_file(match.group('prefix'), match.group('filename'))
+            if filename:
+                return static.serve_file(request, filename)
+
         self.env.switch_to_trac_root(request)
         context = template.RequestContext(request, {})
         req = DjangoRequest(self.env, request, context, None)
@@ -600,8 +1607,9 @@ class Markup(markup_plugins.MarkupBase):
             req.environ['PATH_INFO'] = req.environ.get('PATH_INFO', '').encode('utf-8')
 
         try:
-            dispatcher = DjangoRequestDispatcher(self.env)
-            dispatcher.dispatch(req)
+            with django_request_context(request, context):
+                dispatcher = DjangoRequestDispatcher(self.env)
+                dispatcher.dispatch(req)
         except web.RequestDone:
             pass
         except web.HTTPNotFound, e:
@@ -618,12 +1626,13 @@ class Markup(markup_plugins.MarkupBase):
         return req.django_response
 
     def replace_plugins(self, text, id_dict):
+        new_ids = [id_dict.get(int(plugin_id)) for plugin_id in self.plugin_id_list(text)]
+        plugins = get_plugins([new_id for new_id in new_ids if new_id is not None], downcast=False)
+
         def _replace_tag(m):
             plugin_id = int(m.groups()[0])
             new_id = id_dict.get(plugin_id)
-            try:
-                obj = cms_models.CMSPlugin.objects.get(pk=new_id)
-            except cms_models.CMSPlugin.DoesNotExist:
+            if new_id is None or int(new_id) not in plugins:
                 # Object must have been deleted.  It cannot be rendered to
                 # end user, or edited, so just remove it from the HTML
                 # altogether
@@ -637,6 +1646,74 @@ class Markup(markup_plugins.MarkupBase):
     def plugin_regexp(self):
         return safestring.mark_safe(r"""function(plugin_id) { return new RegExp('\\[\\[CMSPlugin\\(\\s*' + plugin_id + '\\s*\\)\\]\\]', 'g'); }""")
 
+def _get_trac_request(res=None, ctx=None):
+    if getattr(res, 'trac_request', None):
+        return res.trac_request
+    if ctx and isinstance(ctx.req, DjangoRequest):
+        return ctx.req
+    return None
+
+def _add_dependency(realm, id, res=None, ctx=None):
+    req = _get_trac_request(res=res, ctx=ctx)
+    if req:
+        if id is None and res is not None and (realm, res.id) in req.render_links:
+            # Indexed links do not depend on the whole realm
+            return
+        req.render_dependencies.add((realm, id))
+
+def _set_uncacheable(res=None, ctx=None):
+    req = _get_trac_request(res=res, ctx=ctx)
+    if req:
+        req.render_cacheable = False
+
+def _add_hole(req, hole, content=u''):
+    index = len(req.compile_holes)
+    req.compile_holes.append(hole)
+    return genshi_core.Markup(u'<!--tracwiki-hole:%d-->%s<!--/tracwiki-hole:%d-->' % (index, content, index))
+
+def _resource_key(realm, id):
+    return (realm, id, django_translation.get_language())
+
+_current = threading.local()
+
+def set_current_request(request):
+    """
+    Sets (or clears, if `request` is `None`) the request being processed by the current thread.
+    """
+
+    _current.stack = [(request, None)] if request else []
+
+@contextlib.contextmanager
+def django_request_context(request, context=None):
+    """
+    Makes request and context available to rendering code which does not receive them explicitly.
+    """
+
+    if not hasattr(_current, 'stack'):
+        _current.stack = []
+    _current.stack.append((request, context))
+    try:
+        yield
+    finally:
+        _current.stack.pop()
+
+_frame_fallback_hits = {'request': 0, 'context': 0}
+_frame_fallback_lock = threading.Lock()
+
+def get_frame_fallback_hits():
+    """
+    Returns how many times request and context were not passed explicitly nor set by the middleware, so
+    they had to be searched for in stack frames (or were not found, if the fallback is disabled).
+    """
+
+    with _frame_fallback_lock:
+        return dict(_frame_fallback_hits)
+
+def _use_frame_fallback(kind):
+    with _frame_fallback_lock:
+        _frame_fallback_hits[kind] += 1
+    return getattr(settings, 'CMS_MARKUP_TRAC_FRAME_FALLBACK', False)
+
 def _get_django_request(req=None, context=None, res=None, ctx=None):
     if req and getattr(req, 'django_request', None):
         return req.django_request
@@ -646,6 +1723,12 @@ def _get_django_request(req=None, context=None, res=None, ctx=None):
         return res.django_request
     if ctx and ctx.req and getattr(ctx.req, 'django_request', None):
         return ctx.req.django_request
+    for (request, _) in reversed(getattr(_current, 'stack', [])):
+        if request is not None:
+            return request
+
+    if not _use_frame_fallback('request'):
+        return None
 
     frame = inspect.currentframe()
     try:
@@ -665,6 +1748,12 @@ def _get_django_context(req=None, res=None, ctx=None):
         return res.django_context
     if ctx and ctx.req and getattr(ctx.req, 'django_context', None):
         return ctx.req.django_context
+    for (_, context) in reversed(getattr(_current, 'stack', [])):
+        if context is not None:
+            return context
+
+    if not _use_frame_fallback('context'):
+        return None
 
     frame = inspect.currentframe()
     try:
@@ -16,7 +16,7 @@ if __name__ == '__main__':
         author_email = 'mitar.django@tnode.com',
         url = 'http://mitar.tnode.com/',
         license = 'AGPLv3',
-        packages = find_packages(),
+        packages = find_packages(exclude=('benchmarks', 'benchmarks.*')),
         package_data = {},
         classifiers = [
             'Development Status :: 4 - Beta',